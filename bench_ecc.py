@@ -0,0 +1,237 @@
+"""Benchmark suite for the primitives in ecc.py.
+
+Run all the benchmarks and print the results as JSON:
+
+    python bench_ecc.py
+
+Save the results as the baseline, then compare a later run against it and fail if any benchmark got more than 20% slower:
+
+    python bench_ecc.py --output baseline.json
+    python bench_ecc.py --baseline baseline.json --threshold 0.2
+
+Timings are machine dependent, so baselines should only be compared on the same machine.
+"""
+
+import argparse
+import io
+import json
+import platform
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List
+
+from ecc import FieldElement, G, N, KeyPair, HashToCurve, ShamirSecretSharing, StreamingSecretSharing, DistributedKeyGeneration, RSA, TimeLockSolver, RandomnessProvider
+
+class Benchmark:
+    """A named benchmark. setup() is not timed and returns the function to time, which takes no arguments."""
+
+    def __init__(self, name: str, setup: Callable[[], Callable[[], object]], rounds: int = 5):
+        self.name = name
+        self.setup = setup
+        self.rounds = rounds
+
+    def run(self, rounds: int = None) -> Dict[str, float]:
+        """Time the benchmark function and return the statistics in seconds"""
+        function = self.setup()
+        # warm up caches such as fixed base tables
+        function()
+        timings = []
+        for _ in range(rounds or self.rounds):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+        return {'median': statistics.median(timings), 'min': min(timings), 'max': max(timings), 'rounds': len(timings)}
+
+# Benchmarks use a seeded provider so that every run times the same inputs
+def rng() -> RandomnessProvider:
+    return RandomnessProvider(seed=b'bench_ecc')
+
+def scalar_mul() -> Callable[[], object]:
+    scalar = rng().randbelow(N)
+    return lambda: scalar * G
+
+def scalar_mul_ladder() -> Callable[[], object]:
+    scalar = rng().randbelow(N)
+    return lambda: G.mul(scalar, constant_time=True)
+
+def key_pair(constant_time: bool = False) -> Callable[[], object]:
+    secret = rng().randint(1, N - 1)
+    return lambda: KeyPair(secret, constant_time)
+
+def hash_to_curve(count: int) -> Callable[[], object]:
+    messages = [b'message %d' % i for i in range(count)]
+    return lambda: [HashToCurve.hash_to_curve(message) for message in messages]
+
+def hash_to_curve_batch(count: int) -> Callable[[], object]:
+    messages = [b'message %d' % i for i in range(count)]
+    return lambda: HashToCurve.hash_to_curve_batch(messages)
+
+def try_and_increment(count: int) -> Callable[[], object]:
+    messages = [b'message %d' % i for i in range(count)]
+    return lambda: [HashToCurve.try_and_increment(message) for message in messages]
+
+def sharing(t: int, n: int) -> ShamirSecretSharing:
+    provider = rng()
+    return ShamirSecretSharing(t, n, FieldElement(provider.randint(1, N - 1), N), rng=provider)
+
+def commit_feldman(t: int, n: int) -> Callable[[], object]:
+    sss = sharing(t, n)
+    _, coefficients = sss.split_secret()
+    return lambda: sss.commit_coefficients_ec(coefficients, G)
+
+def verify_feldman(t: int, n: int) -> Callable[[], object]:
+    sss = sharing(t, n)
+    shares, coefficients = sss.split_secret()
+    commitments = sss.commit_coefficients_ec(coefficients, G)
+    return lambda: [sss.verify_share_ec(share, commitments, G) for share in shares]
+
+def commit_pedersen(t: int, n: int) -> Callable[[], object]:
+    sss = sharing(t, n)
+    _, coefficients, blinding_coefficients = sss.split_secret_pedersen()
+    return lambda: sss.commit_coefficients_pedersen(coefficients, blinding_coefficients)
+
+def verify_pedersen(t: int, n: int) -> Callable[[], object]:
+    sss = sharing(t, n)
+    shares, coefficients, blinding_coefficients = sss.split_secret_pedersen()
+    commitments = sss.commit_coefficients_pedersen(coefficients, blinding_coefficients)
+    return lambda: [sss.verify_share_pedersen(share, commitments) for share in shares]
+
+def verify_pedersen_batch(t: int, n: int) -> Callable[[], object]:
+    sss = sharing(t, n)
+    shares, coefficients, blinding_coefficients = sss.split_secret_pedersen()
+    commitments = sss.commit_coefficients_pedersen(coefficients, blinding_coefficients)
+    return lambda: sss.verify_shares_pedersen(shares, commitments)
+
+def recover_secret(t: int, n: int) -> Callable[[], object]:
+    sss = sharing(t, n)
+    shares, _ = sss.split_secret()
+    return lambda: sss.recover_secret(shares)
+
+def recover_secret_ec(t: int, n: int) -> Callable[[], object]:
+    sss = sharing(t, n)
+    shares, _ = sss.split_secret()
+    point_shares = [(x, y.num * G) for x, y in shares]
+    return lambda: sss.recover_secret_ec(point_shares)
+
+def split_stream(t: int, n: int, size: int) -> Callable[[], object]:
+    sss = StreamingSecretSharing(t, n, N, rng=rng())
+    payload = rng().random_bytes(size)
+    return lambda: sss.split_stream(io.BytesIO(payload), [io.BytesIO() for _ in range(n)])
+
+def dkg(t: int, n: int) -> Callable[[], object]:
+    provider = rng()
+    secrets = [FieldElement(provider.randint(1, N - 1), N) for _ in range(n)]
+    def ceremony():
+        ceremony = DistributedKeyGeneration(t, n, N)
+        for secret in secrets:
+            ceremony.add_member(secret)
+        ceremony.kick_off_ceremony()
+    return ceremony
+
+def rsa_generate(bits: int) -> Callable[[], object]:
+    provider = rng()
+    return lambda: RSA.generate(bits, provider)
+
+def rsa_encrypt(bits: int) -> Callable[[], object]:
+    rsa = RSA.generate(bits, rng())
+    messages = rng().randbelow_many(rsa.n, 100)
+    return lambda: rsa.encrypt_many(messages)
+
+def rsa_decrypt(bits: int) -> Callable[[], object]:
+    rsa = RSA.generate(bits, rng())
+    ciphertexts = rsa.encrypt_many(rng().randbelow_many(rsa.n, 100))
+    return lambda: rsa.decrypt_many(ciphertexts)
+
+def time_lock_solve(bits: int, t: int) -> Callable[[], object]:
+    provider = rng()
+    n = provider.randbits(bits) | (1 << (bits - 1)) | 1
+    a = provider.randint(2, n - 1)
+    solver = TimeLockSolver()
+    return lambda: solver.solve(n, a, t)
+
+SHARING_SIZES = [(3, 5), (5, 10), (10, 20)]
+KEY_SIZES = [1024, 2048]
+
+def benchmarks() -> List[Benchmark]:
+    """Return all the benchmarks of the suite"""
+    suite = [
+        Benchmark('S256Point.__rmul__', scalar_mul, rounds=20),
+        Benchmark('S256Point.ladder', scalar_mul_ladder, rounds=20),
+        Benchmark('KeyPair', key_pair, rounds=20),
+        Benchmark('KeyPair[constant_time]', lambda: key_pair(True), rounds=20),
+    ]
+    for count in [1, 100]:
+        suite += [
+            Benchmark('HashToCurve.hash_to_curve[messages={}]'.format(count), lambda count=count: hash_to_curve(count)),
+            Benchmark('HashToCurve.hash_to_curve_batch[messages={}]'.format(count), lambda count=count: hash_to_curve_batch(count)),
+            Benchmark('HashToCurve.try_and_increment[messages={}]'.format(count), lambda count=count: try_and_increment(count)),
+        ]
+    for t, n in SHARING_SIZES:
+        size = 't={},N={}'.format(t, n)
+        suite += [
+            Benchmark('commit_coefficients_ec[{}]'.format(size), lambda t=t, n=n: commit_feldman(t, n)),
+            Benchmark('verify_share_ec[{}]'.format(size), lambda t=t, n=n: verify_feldman(t, n)),
+            Benchmark('commit_coefficients_pedersen[{}]'.format(size), lambda t=t, n=n: commit_pedersen(t, n)),
+            Benchmark('verify_share_pedersen[{}]'.format(size), lambda t=t, n=n: verify_pedersen(t, n)),
+            Benchmark('verify_shares_pedersen[{}]'.format(size), lambda t=t, n=n: verify_pedersen_batch(t, n)),
+            Benchmark('recover_secret[{}]'.format(size), lambda t=t, n=n: recover_secret(t, n)),
+            Benchmark('recover_secret_ec[{}]'.format(size), lambda t=t, n=n: recover_secret_ec(t, n)),
+            Benchmark('kick_off_ceremony[{}]'.format(size), lambda t=t, n=n: dkg(t, n)),
+        ]
+    suite.append(Benchmark('split_stream[t=3,N=5,1MiB]', lambda: split_stream(3, 5, 2**20), rounds=3))
+    for bits in KEY_SIZES:
+        suite += [
+            Benchmark('RSA.generate[bits={}]'.format(bits), lambda bits=bits: rsa_generate(bits), rounds=3),
+            Benchmark('RSA.encrypt_many[bits={},messages=100]'.format(bits), lambda bits=bits: rsa_encrypt(bits)),
+            Benchmark('RSA.decrypt_many[bits={},messages=100]'.format(bits), lambda bits=bits: rsa_decrypt(bits)),
+        ]
+    for t in [10**4, 10**5]:
+        suite.append(Benchmark('TimeLockSolver.solve[bits=2048,t={}]'.format(t), lambda t=t: time_lock_solve(2048, t), rounds=3))
+    return suite
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], threshold: float) -> List[str]:
+    """Return a description of every benchmark whose median is more than `threshold` (a fraction) slower than in the baseline"""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['median'] / baseline[name]['median']
+        if ratio > 1 + threshold:
+            regressions.append('{}: {:.6f}s -> {:.6f}s ({:+.1%})'.format(name, baseline[name]['median'], result['median'], ratio - 1))
+    return regressions
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the primitives in ecc.py')
+    parser.add_argument('--filter', default='', help='only run the benchmarks whose name contains this string')
+    parser.add_argument('--rounds', type=int, default=None, help='override the number of timed rounds of every benchmark')
+    parser.add_argument('--output', default=None, help='write the results as JSON to this file instead of stdout')
+    parser.add_argument('--baseline', default=None, help='JSON file of a previous run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='maximum allowed slowdown relative to the baseline, as a fraction (default 0.2)')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for benchmark in benchmarks():
+        if args.filter not in benchmark.name:
+            continue
+        results[benchmark.name] = benchmark.run(args.rounds)
+        print('{:<50} {:.6f}s'.format(benchmark.name, results[benchmark.name]['median']), file=sys.stderr)
+
+    report = {'python': platform.python_version(), 'machine': platform.machine(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print('REGRESSION ' + regression, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,33 @@
+from collections import OrderedDict
+from typing import List, Tuple
+
+class LRUCache:
+    """Cache of precomputed tables that evicts the least recently used entry when it is full.
+    Tables of frequently used bases, such as G, stay cached while tables of one-off bases are evicted first.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def get_or_build(self, key, build):
+        """Return the entry for key, calling build() to create it on a miss"""
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        value = build()
+        self._entries[key] = value
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return value
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+
 class FieldElement:
 
     def __init__(self, num : int, prime : int):
@@ -62,6 +92,83 @@ class FieldElement:
     def __rmul__(self, coefficient):
         num = (self.num * coefficient) % self.prime
         return self.__class__(num=num, prime=self.prime)
+
+    @staticmethod
+    def multi_pow(bases: List['FieldElement'], exponents: List[int], window: int = 4) -> 'FieldElement':
+        """Compute bases[0]^exponents[0] * ... * bases[k]^exponents[k] with Straus' simultaneous exponentiation.
+        The squarings are shared across all the bases, so the cost is one exponentiation plus one multiplication per non-zero window of each exponent.
+        """
+        if len(bases) != len(exponents):
+            raise ValueError('bases and exponents must have the same length')
+        prime = bases[0].prime
+        # tables[k][d] = bases[k]^d for every window digit d
+        tables = []
+        for base in bases:
+            if base.prime != prime:
+                raise TypeError("Cannot multiply two number in different Fields")
+            row = [1, base.num]
+            for _ in range(2**window - 2):
+                row.append(row[-1] * base.num % prime)
+            tables.append(row)
+        mask = 2**window - 1
+        windows = (max(exponent.bit_length() for exponent in exponents) + window - 1) // window
+        result = 1
+        for position in range(windows - 1, -1, -1):
+            for _ in range(window):
+                result = result * result % prime
+            shift = position * window
+            for exponent, row in zip(exponents, tables):
+                digit = (exponent >> shift) & mask
+                if digit:
+                    result = result * row[digit] % prime
+        return bases[0].__class__(result, prime)
+
+class FixedBasePowerTable:
+    """Precomputed powers of a fixed base in the multiplicative group of a finite field for fast exponentiation.
+    The exponent is split into windows of `window` bits. For every window position i the table stores base^(d * 2^(window * i)) for each digit d,
+    so that an exponentiation costs one multiplication per non-zero window and no squarings.
+    """
+
+    _cache = LRUCache(16)
+
+    def __init__(self, base: FieldElement, order: int, window: int = 4):
+        """Build the table for the given base whose multiplicative order is `order`"""
+        self.base = base
+        self.order = order
+        self.window = window
+        prime = base.prime
+        self.rows = []
+        row_base = base.num
+        for _ in range((order.bit_length() + window - 1) // window):
+            row = [1, row_base]
+            for _ in range(2**window - 2):
+                row.append(row[-1] * row_base % prime)
+            self.rows.append(row)
+            row_base = row[-1] * row_base % prime
+        # exponents are reduced modulo order, which is only sound if base^order == 1
+        if pow(base.num, order, prime) != 1:
+            raise ValueError('The order of {} does not divide {}'.format(base, order))
+
+    @classmethod
+    def for_element(cls, base: FieldElement, order: int, window: int = 4) -> 'FixedBasePowerTable':
+        """Return the table for the given base, building it on first use and caching it"""
+        key = (base.num, base.prime, order, window)
+        return cls._cache.get_or_build(key, lambda: cls(base, order, window))
+
+    def pow(self, exponent: int) -> FieldElement:
+        """Return base^exponent"""
+        exp = exponent % self.order
+        prime = self.base.prime
+        mask = 2**self.window - 1
+        result = 1
+        for row in self.rows:
+            if not exp:
+                break
+            digit = exp & mask
+            if digit:
+                result = result * row[digit] % prime
+            exp >>= self.window
+        return self.base.__class__(result, prime)
     
 P = 2**256 - 2**32 - 977
 
@@ -75,12 +182,13 @@ class S256Field(FieldElement):
 
 class Point:
 
-    def __init__(self, x, y, a, b):
+    def __init__(self, x, y, a, b, check=True):
+        """Initialize the point. check can be set to False for points that are known to be on the curve, such as constants"""
         self.a = a
         self.b = b
         self.x = x
         self.y = y
-        if self.x is None and self.y is None:
+        if self.x is None and self.y is None or not check:
             return
         if self.y**2 != self.x**3 + a * x + b:
             raise ValueError('({}, {}) is not on the curve'.format(x, y))
@@ -141,6 +249,36 @@ class Point:
             current += current  # <4>
             coef >>= 1  # <5>
         return result
+
+    @staticmethod
+    def multi_scalar_mul(scalars: List[int], points: List['Point'], window: int = 4) -> 'Point':
+        """Compute scalars[0] * points[0] + ... + scalars[k] * points[k] with Straus' interleaved window method.
+        The doublings are shared across all the points, so the cost is one scalar multiplication plus one addition per non-zero window of each scalar.
+        """
+        if len(scalars) != len(points):
+            raise ValueError('scalars and points must have the same length')
+        if not points:
+            raise ValueError('at least one point is required')
+        first = points[0]
+        result = first.__class__(None, None, first.a, first.b)
+        # tables[k][d - 1] = d * points[k] for every window digit d
+        tables = []
+        for point in points:
+            row = [point]
+            for _ in range(2**window - 2):
+                row.append(row[-1] + point)
+            tables.append(row)
+        mask = 2**window - 1
+        windows = (max(scalar.bit_length() for scalar in scalars) + window - 1) // window
+        for position in range(windows - 1, -1, -1):
+            for _ in range(window):
+                result += result
+            shift = position * window
+            for scalar, row in zip(scalars, tables):
+                digit = (scalar >> shift) & mask
+                if digit:
+                    result += row[digit - 1]
+        return result
     
 
 A = 0
@@ -148,16 +286,110 @@ B = 7
 N = 0xfffffffffffffffffffffffffffffffebaaedce6af48a03bbfd25e8cd0364141
 
 class S256Point(Point):
+
+    # Default scalar multiplication mode: True selects the constant time Montgomery ladder for every multiplication that does not choose a mode explicitly
+    constant_time = False
     
-    def __init__(self, x, y, a=None, b=None):
+    def __init__(self, x, y, a=None, b=None, check=True):
         if type(x) == int:
-            super().__init__(S256Field(x), S256Field(y), S256Field(A), S256Field(B))
+            super().__init__(S256Field(x), S256Field(y), S256Field(A), S256Field(B), check)
         else: # this is for the case in which we init the point at infinity
-            super().__init__(x, y, S256Field(A), S256Field(B))
+            super().__init__(x, y, S256Field(A), S256Field(B), check)
 
     def __rmul__(self, coefficient):
+        return self.mul(coefficient)
+
+    def mul(self, coefficient: int, constant_time: bool = None) -> 'S256Point':
+        """Return coefficient * self.
+        With constant_time=True the Montgomery ladder is used, which performs the same sequence of operations for every scalar and should be used for secret scalars.
+        Otherwise the faster double and add algorithm, which branches on the bits of the scalar, is used. If constant_time is None, S256Point.constant_time decides.
+        """
+        if constant_time is None:
+            constant_time = S256Point.constant_time
+        if constant_time:
+            return self.ladder(coefficient)
         coef = coefficient % N
         return super().__rmul__(coef)
+
+    @staticmethod
+    def _complete_add(X1: int, Y1: int, Z1: int, X2: int, Y2: int, Z2: int) -> Tuple[int, int, int]:
+        """Add two points in projective coordinates with the complete formulas for a = 0 curves (Renes, Costello, Batina 2016, algorithm 7).
+        The formulas have no special cases: they also double a point and handle the point at infinity (0 : 1 : 0).
+        """
+        b3 = 3 * B
+        t0 = X1 * X2 % P
+        t1 = Y1 * Y2 % P
+        t2 = Z1 * Z2 % P
+        t3 = (X1 + Y1) * (X2 + Y2) % P
+        t4 = t0 + t1
+        t3 = (t3 - t4) % P
+        t4 = (Y1 + Z1) * (Y2 + Z2) % P
+        X3 = t1 + t2
+        t4 = (t4 - X3) % P
+        X3 = (X1 + Z1) * (X2 + Z2) % P
+        Y3 = t0 + t2
+        Y3 = (X3 - Y3) % P
+        t0 = 3 * t0 % P
+        t2 = b3 * t2 % P
+        Z3 = (t1 + t2) % P
+        t1 = (t1 - t2) % P
+        Y3 = b3 * Y3 % P
+        X3 = (t3 * t1 - t4 * Y3) % P
+        Y3 = (Y3 * t0 + t1 * Z3) % P
+        Z3 = (Z3 * t4 + t0 * t3) % P
+        return X3, Y3, Z3
+
+    def ladder(self, coefficient: int) -> 'S256Point':
+        """Return coefficient * self with the Montgomery ladder.
+        Every one of the 256 steps performs one addition and one doubling with the complete formulas, and the points are swapped with arithmetic masks instead of branches,
+        so the sequence of operations does not depend on the scalar. Python integers are not constant time, so this reduces but does not eliminate timing leaks.
+        """
+        if self.x is None:
+            return self.__class__(None, None)
+        coef = coefficient % N
+        R0 = (0, 1, 0)
+        R1 = (self.x.num, self.y.num, 1)
+        mask_all = (1 << 256) - 1
+        for i in range(N.bit_length() - 1, -1, -1):
+            # mask is all ones if the bit is set and zero otherwise
+            mask = -((coef >> i) & 1) & mask_all
+            R0, R1 = S256Point._cswap(R0, R1, mask)
+            R1 = S256Point._complete_add(*R0, *R1)
+            R0 = S256Point._complete_add(*R0, *R0)
+            R0, R1 = S256Point._cswap(R0, R1, mask)
+        X, Y, Z = R0
+        if Z == 0:
+            return self.__class__(None, None)
+        z_inv = pow(Z, P - 2, P)
+        return self.__class__(X * z_inv % P, Y * z_inv % P, check=False)
+
+    @staticmethod
+    def _cswap(R0: Tuple[int, int, int], R1: Tuple[int, int, int], mask: int) -> Tuple[Tuple[int, int, int], Tuple[int, int, int]]:
+        """Swap the two points if mask is all ones, leave them unchanged if mask is zero"""
+        swapped0, swapped1 = [], []
+        for a, b in zip(R0, R1):
+            d = (a ^ b) & mask
+            swapped0.append(a ^ d)
+            swapped1.append(b ^ d)
+        return tuple(swapped0), tuple(swapped1)
+
+    @staticmethod
+    def multi_scalar_mul(scalars: List[int], points: List['S256Point'], window: int = 4) -> 'S256Point':
+        """Compute the linear combination of the points with the scalars reduced modulo the group order N"""
+        return Point.multi_scalar_mul([scalar % N for scalar in scalars], points, window)
+
+    @classmethod
+    def lift_x(cls, x: int) -> 'S256Point':
+        """Return the point with the given x coordinate and an even y coordinate, or None if x is not on the curve"""
+        x = S256Field(x)
+        alpha = x**3 + S256Field(B)
+        # P % 4 == 3, so the square root is alpha^((P + 1) / 4)
+        beta = alpha ** ((P + 1) // 4)
+        if beta * beta != alpha:
+            return None
+        if beta.num % 2 == 1:
+            beta = S256Field(P - beta.num)
+        return cls(x, beta)
     
     def __repr__(self):
         if self.x is None:
@@ -166,23 +398,248 @@ class S256Point(Point):
             return 'S256Point({}, {})'.format(self.x, self.y)
 
 
+# The generator is a well known constant, so the on-curve check is skipped at import time
 G = S256Point(
     0x79be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798,
-    0x483ada7726a3c4655da4fbfc0e1108a8fd17b448a68554199c47d08ffb10d4b8
+    0x483ada7726a3c4655da4fbfc0e1108a8fd17b448a68554199c47d08ffb10d4b8,
+    check=False
 )
 
-from Crypto.Hash import keccak
+class FixedBaseTable:
+    """Precomputed multiples of a fixed base point for fast scalar multiplication.
+    The scalar is split into windows of `window` bits. For every window position i the table stores d * 2^(window * i) * base for each digit d,
+    so that a scalar multiplication costs one point addition per non-zero window and no doublings.
+    """
+
+    _cache = LRUCache(16)
+
+    def __init__(self, base: Point, order: int = N, window: int = 4):
+        """Build the table for the given base point whose order is `order`"""
+        if base.x is None:
+            raise ValueError('Cannot build a fixed base table for the point at infinity')
+        self.base = base
+        self.order = order
+        self.window = window
+        self.identity = base.__class__(None, None, base.a, base.b)
+        self.rows = []
+        row_base = base
+        for _ in range((order.bit_length() + window - 1) // window):
+            row = [row_base]
+            for _ in range(2**window - 2):
+                row.append(row[-1] + row_base)
+            self.rows.append(row)
+            row_base = row[-1] + row_base
+
+    @classmethod
+    def for_point(cls, base: Point, order: int = N, window: int = 4) -> 'FixedBaseTable':
+        """Return the table for the given base point, building it on first use and caching it"""
+        if base.x is None:
+            raise ValueError('Cannot build a fixed base table for the point at infinity')
+        key = (base.x.num, base.y.num, base.x.prime, order, window)
+        return cls._cache.get_or_build(key, lambda: cls(base, order, window))
+
+    def mul(self, coefficient: int, result: Point = None) -> Point:
+        """Return coefficient * base, added to `result` when given"""
+        coef = coefficient % self.order
+        if result is None:
+            result = self.identity
+        mask = 2**self.window - 1
+        for row in self.rows:
+            if not coef:
+                break
+            digit = coef & mask
+            if digit:
+                result += row[digit - 1]
+            coef >>= self.window
+        return result
+
+import hashlib
+
+class HashToCurve:
+    """Map byte strings to points on the secp256k1 curve whose discrete logarithm is unknown.
+    hash_to_curve implements the secp256k1_XMD:SHA-256_SSWU_RO_ suite of RFC 9380: the simplified SWU map does not work for a = 0 curves,
+    so it maps to a curve E' that is 3-isogenous to secp256k1 and the isogeny brings the point back. try_and_increment is a simpler, slower alternative.
+    """
+
+    DST = b'tomaquet-ecc-V01-CS02-with-secp256k1_XMD:SHA-256_SSWU_RO_'
+    # E': y^2 = x^3 + ISO_A * x + ISO_B, and the non-square Z of the simplified SWU map
+    ISO_A = 0x3f8731abdd661adca08a5558f0f5d272e953d363cb6f0e5d405447c01a444533
+    ISO_B = 1771
+    Z = P - 11
+    # Coefficients of the 3-isogeny from E' to secp256k1 (RFC 9380, appendix E.1)
+    ISO_X_NUM = [
+        0x8e38e38e38e38e38e38e38e38e38e38e38e38e38e38e38e38e38e38daaaaa8c7,
+        0x07d3d4c80bc321d5b9f315cea7fd44c5d595d2fc0bf63b92dfff1044f17c6581,
+        0x534c328d23f234e6e2a413deca25caece4506144037c40314ecbd0b53d9dd262,
+        0x8e38e38e38e38e38e38e38e38e38e38e38e38e38e38e38e38e38e38daaaaa88c,
+    ]
+    ISO_X_DEN = [
+        0xd35771193d94918a9ca34ccbb7b640dd86cd409542f8487d9fe6b745781eb49b,
+        0xedadc6f64383dc1df7c4b2d51b54225406d36b641f5e41bbc52a56612a8c6d14,
+        1,
+    ]
+    ISO_Y_NUM = [
+        0x4bda12f684bda12f684bda12f684bda12f684bda12f684bda12f684b8e38e23c,
+        0xc75e0c32d5cb7c0fa9d0a54b12a0a6d5647ab046d686da6fdffc90fc201d71a3,
+        0x29a6194691f91a73715209ef6512e576722830a201be2018a765e85a9ecee931,
+        0x2f684bda12f684bda12f684bda12f684bda12f684bda12f684bda12f38e38d84,
+    ]
+    ISO_Y_DEN = [
+        0xfffffffffffffffffffffffffffffffffffffffffffffffffffffffefffff93b,
+        0x7a06534bb8bdb49fd5e9e6632722c2989467c1bfc8e8d978dfb425d2685c2573,
+        0x6484aa716545ca2cf3a70c3fa8fe337e0a3d21162f0d6299a7bf8192bfd2a76f,
+        1,
+    ]
+
+    @staticmethod
+    def expand_message_xmd(message: bytes, dst: bytes, length: int) -> bytes:
+        """Expand the message into length uniformly random bytes with SHA-256 (RFC 9380, section 5.3.1)"""
+        ell = (length + 31) // 32
+        if ell > 255 or length > 65535 or len(dst) > 255:
+            raise ValueError('requested length or domain separation tag is too long')
+        dst_prime = dst + bytes([len(dst)])
+        b_0 = hashlib.sha256(bytes(64) + message + length.to_bytes(2, 'big') + b'\x00' + dst_prime).digest()
+        blocks = [hashlib.sha256(b_0 + b'\x01' + dst_prime).digest()]
+        for i in range(2, ell + 1):
+            mixed = bytes(x ^ y for x, y in zip(b_0, blocks[-1]))
+            blocks.append(hashlib.sha256(mixed + bytes([i]) + dst_prime).digest())
+        return b''.join(blocks)[:length]
+
+    @staticmethod
+    def hash_to_field(message: bytes, count: int, dst: bytes = DST) -> List[int]:
+        """Hash the message to count elements of the base field, each derived from 48 bytes so that the bias is negligible"""
+        uniform_bytes = HashToCurve.expand_message_xmd(message, dst, 48 * count)
+        return [int.from_bytes(uniform_bytes[48 * i:48 * (i + 1)], 'big') % P for i in range(count)]
+
+    @staticmethod
+    def _batch_inverse(values: List[int]) -> List[int]:
+        """Invert many field elements with a single exponentiation (Montgomery's trick). Zero is mapped to zero"""
+        prefix = []
+        acc = 1
+        for value in values:
+            prefix.append(acc)
+            if value:
+                acc = acc * value % P
+        inverse = pow(acc, P - 2, P)
+        result = [0] * len(values)
+        for i in range(len(values) - 1, -1, -1):
+            if values[i]:
+                result[i] = prefix[i] * inverse % P
+                inverse = inverse * values[i] % P
+        return result
+
+    @staticmethod
+    def _polynomial(coefficients: List[int], x: int) -> int:
+        """Evaluate the polynomial with coefficients in increasing degree order at x"""
+        result = 0
+        for coefficient in reversed(coefficients):
+            result = (result * x + coefficient) % P
+        return result
+
+    @staticmethod
+    def map_to_curve_batch(field_elements: List[int]) -> List[Tuple[int, int]]:
+        """Map field elements to affine points of secp256k1 with the simplified SWU map to E' followed by the 3-isogeny.
+        A single square root exponentiation is needed per element, and all the inversions of the batch are shared.
+        """
+        A, B, Z = HashToCurve.ISO_A, HashToCurve.ISO_B, HashToCurve.Z
+        minus_b_over_a = -B * pow(A, -1, P) % P
+        b_over_za = B * pow(Z * A, -1, P) % P
+        # Z is not a square and P = 3 mod 4, so -Z^3 is a square
+        sqrt_minus_z3 = pow(-Z**3 % P, (P + 1) // 4, P)
+
+        z_u2 = [Z * u * u % P for u in field_elements]
+        tv1 = HashToCurve._batch_inverse([(t * t + t) % P for t in z_u2])
+        points = []
+        for u, z_u2_i, tv1_i in zip(field_elements, z_u2, tv1):
+            x1 = minus_b_over_a * (1 + tv1_i) % P if tv1_i else b_over_za
+            gx1 = (x1 * x1 * x1 + A * x1 + B) % P
+            # c^2 is gx1 if gx1 is a square and -gx1 otherwise
+            c = pow(gx1, (P + 1) // 4, P)
+            if c * c % P == gx1:
+                x, y = x1, c
+            else:
+                # gx2 = (Z u^2)^3 gx1, so sqrt(gx2) = u^3 * sqrt(-Z^3) * sqrt(-gx1)
+                x = z_u2_i * x1 % P
+                y = u * u * u * sqrt_minus_z3 * c % P
+            if y % 2 != u % 2:
+                y = -y % P
+            points.append((x, y))
+
+        iso = HashToCurve
+        denominators = []
+        for x, _ in points:
+            denominators += [HashToCurve._polynomial(iso.ISO_X_DEN, x), HashToCurve._polynomial(iso.ISO_Y_DEN, x)]
+        inverses = HashToCurve._batch_inverse(denominators)
+        mapped = []
+        for k, (x, y) in enumerate(points):
+            mapped.append((
+                HashToCurve._polynomial(iso.ISO_X_NUM, x) * inverses[2 * k] % P,
+                y * HashToCurve._polynomial(iso.ISO_Y_NUM, x) * inverses[2 * k + 1] % P,
+            ))
+        return mapped
+
+    @staticmethod
+    def hash_to_curve_batch(messages: List[bytes], dst: bytes = DST) -> List[S256Point]:
+        """Hash many messages to points of secp256k1 (RFC 9380 random oracle encoding), sharing the inversions across the whole batch"""
+        field_elements = []
+        for message in messages:
+            field_elements += HashToCurve.hash_to_field(message, 2, dst)
+        mapped = HashToCurve.map_to_curve_batch(field_elements)
+        pairs = [(mapped[2 * k], mapped[2 * k + 1]) for k in range(len(messages))]
+        # add the two points of each message, with one shared inversion for all the slopes
+        inverses = HashToCurve._batch_inverse([(x1 - x0) % P for (x0, _), (x1, _) in pairs])
+        points = []
+        for ((x0, y0), (x1, y1)), inverse in zip(pairs, inverses):
+            if x0 == x1:
+                # doubling or opposite points, too rare to be worth batching
+                points.append(S256Point(x0, y0, check=False) + S256Point(x1, y1, check=False))
+                continue
+            s = (y1 - y0) * inverse % P
+            x2 = (s * s - x0 - x1) % P
+            y2 = (s * (x0 - x2) - y0) % P
+            points.append(S256Point(x2, y2, check=False))
+        return points
+
+    @staticmethod
+    def hash_to_curve(message: bytes, dst: bytes = DST) -> S256Point:
+        """Hash the message to a point of secp256k1 (RFC 9380 random oracle encoding)"""
+        return HashToCurve.hash_to_curve_batch([message], dst)[0]
+
+    @staticmethod
+    def try_and_increment(message: bytes, dst: bytes = b'tomaquet-ecc') -> S256Point:
+        """Hash the domain separation tag, the message and a counter to a candidate x coordinate, incrementing the counter until it lands on the curve"""
+        counter = 0
+        while True:
+            digest = hashlib.sha256(dst + message + counter.to_bytes(4, 'big')).digest()
+            x = int.from_bytes(digest, 'big')
+            if x < P:
+                point = S256Point.lift_x(x)
+                if point is not None:
+                    return point
+            counter += 1
+
+# Second generator for Pedersen commitments. Nobody knows its discrete logarithm with respect to G, as it is derived by hashing G:
+# H = HashToCurve.try_and_increment(bytes.fromhex(KeyPair(1).public_key()), dst=b'tomaquet-ecc-pedersen-H')
+# The coordinates are hardcoded to keep hashing out of the import, and the derivation is checked by the tests.
+H = S256Point(
+    0x67cef0adfdd7eefe0c5795f6514e7983fd47853c92749d29ff6553d49d0c2f59,
+    0x7098876a058069ae7c61db602515bd9415ef894f5215036389b4215ecc5ad77e,
+    check=False
+)
 
 class KeyPair:
     """Represents a key pair for elliptic curve cryptography."""
 
-    def __init__(self, secret):
-        """Initialize the KeyPair with a given secret."""
+    def __init__(self, secret, constant_time: bool = None):
+        """Initialize the KeyPair with a given secret.
+        constant_time selects the scalar multiplication mode for the operations involving the secret, see S256Point.mul.
+        """
         # verify that secret is in range [1, n-1]
         if secret < 1 or secret >= N:
             raise ValueError('secret must be an integer in the range [1, n-1]')
         self.secret = secret
-        self.point = secret * G
+        self.constant_time = constant_time
+        self.point = G.mul(secret, constant_time)
 
     def private_key(self) -> str:
         """Return the private key in hexadecimal format."""
@@ -198,48 +655,145 @@ class KeyPair:
 
     def address(self) -> str:
         """Calculate and return the Ethereum address derived from the public key."""
+        # imported here, as pycryptodome is only needed for addresses and is slow to import
+        from Crypto.Hash import keccak
         keccak_hash = keccak.new(digest_bits=256)
         keccak_hash.update(bytes.fromhex(self.public_key_no_prefix()))
         return '0x' + keccak_hash.hexdigest()[-40:]
     
     def generate_shared_secret(self, public_key_other: S256Point) -> S256Point:
         """Generate the shared secret from the public key of the other party."""
-        return self.secret * public_key_other
+        return public_key_other.mul(self.secret, self.constant_time)
     
-import random
-from typing import List, Tuple
+import os
+import secrets
+
+class RandomnessProvider:
+    """Source of uniformly distributed random integers for coefficients, keys and nonces.
+    Random bytes are drawn in large blocks, either from the operating system CSPRNG (os.urandom) or, when a seed is given, from SHAKE-256 in counter mode.
+    The seeded mode is deterministic and meant for reproducible tests and benchmarks only: never use it to generate real secrets.
+    Integers below a bound are sampled by rejection, so they are exactly uniform.
+    Buffered os.urandom bytes are discarded in a forked child, so the child never reuses bytes that the parent also hands out.
+    """
+
+    _default = None
+
+    def __init__(self, seed: bytes = None, block_size: int = 4096):
+        """Initialize the provider. If seed is None the randomness comes from os.urandom"""
+        if isinstance(seed, int):
+            seed = seed.to_bytes((seed.bit_length() + 7) // 8 or 1, 'big')
+        self.seed = seed
+        self.block_size = block_size
+        self._counter = 0
+        self._buffer = b''
+        self._offset = 0
+        self._pid = os.getpid()
+
+    @classmethod
+    def default(cls) -> 'RandomnessProvider':
+        """Return the provider used when no provider is passed explicitly"""
+        if cls._default is None:
+            cls._default = cls()
+        return cls._default
+
+    @classmethod
+    def set_default(cls, provider: 'RandomnessProvider'):
+        """Replace the provider used when no provider is passed explicitly. Passing None restores the os.urandom provider"""
+        cls._default = provider
+
+    def _next_block(self, size: int) -> bytes:
+        """Return a fresh block of at least size random bytes"""
+        size = max(size, self.block_size)
+        if self.seed is None:
+            return os.urandom(size)
+        block = hashlib.shake_256(self.seed + self._counter.to_bytes(8, 'big')).digest(size)
+        self._counter += 1
+        return block
+
+    def random_bytes(self, n: int) -> bytes:
+        """Return n random bytes"""
+        if self.seed is None and self._pid != os.getpid():
+            self._buffer = b''
+            self._offset = 0
+            self._pid = os.getpid()
+        if self._offset + n > len(self._buffer):
+            self._buffer = self._buffer[self._offset:] + self._next_block(n)
+            self._offset = 0
+        data = self._buffer[self._offset:self._offset + n]
+        self._offset += n
+        return data
+
+    def randbits(self, k: int) -> int:
+        """Return a random integer of at most k bits"""
+        return int.from_bytes(self.random_bytes((k + 7) // 8), 'big') >> (-k % 8)
+
+    def randbelow_many(self, n: int, count: int) -> List[int]:
+        """Return count random integers uniformly distributed in [0, n - 1]"""
+        if n < 1:
+            raise ValueError('n must be a positive integer')
+        k = n.bit_length()
+        size = (k + 7) // 8
+        shift = -k % 8
+        values = []
+        while len(values) < count:
+            # every candidate is accepted with probability at least 1/2, so draw for all the missing values at once
+            missing = count - len(values)
+            data = self.random_bytes(size * missing)
+            for offset in range(0, size * missing, size):
+                candidate = int.from_bytes(data[offset:offset + size], 'big') >> shift
+                if candidate < n:
+                    values.append(candidate)
+        return values
+
+    def randbelow(self, n: int) -> int:
+        """Return a random integer uniformly distributed in [0, n - 1]"""
+        return self.randbelow_many(n, 1)[0]
+
+    def randint(self, a: int, b: int) -> int:
+        """Return a random integer uniformly distributed in [a, b]"""
+        return a + self.randbelow(b - a + 1)
+
+    def field_elements(self, count: int, prime: int, low: int = 0) -> List[FieldElement]:
+        """Return count random elements of the field of order prime, uniformly distributed in [low, prime - 1]"""
+        return [FieldElement(low + value, prime) for value in self.randbelow_many(prime - low, count)]
 
 class ShamirSecretSharing:
     """Object containing to perform Shamir Secret Sharing with a trusted dealer initializing a secret a sharing across N parties.
     Shamir's Secret Sharing is a method for dividing a secret value into multiple shares so that a specified number of shares (the threshold) is required to reconstruct the secret.
-    It also contains support to Verifiable Secret Sharing based on Feldman's VSS scheme. 
+    It also contains support to Verifiable Secret Sharing based on Feldman's VSS scheme and on Pedersen's VSS scheme. 
     """
 
-    def __init__(self, t: int, N: int, secret: FieldElement):
-        """Initialize the ShamirSecretSharing object of t out on N threshold with the given secret living in a finite field"""
+    def __init__(self, t: int, N: int, secret: FieldElement, rng: RandomnessProvider = None):
+        """Initialize the ShamirSecretSharing object of t out on N threshold with the given secret living in a finite field.
+        The coefficients are drawn from rng, or from the default RandomnessProvider if rng is None.
+        """
         assert t <= N
         self.secret = secret
         self.prime = secret.prime
         self.t = t
         self.N = N
+        self.rng = rng
     
     @staticmethod
-    def generate_coefficients(t, prime) -> List[FieldElement]:
+    def generate_coefficients(t, prime, rng: RandomnessProvider = None) -> List[FieldElement]:
         """Generate t - 1 random coefficients (between 1 and prime-1) for a polynomial of degree 't - 1'.
         f(x) = secret + a1*x + a2*x^2 + ... + at-1*x^t-1
         Returns an array coefficient representing the polynomial.
         """
         degree = t - 1
-        coefficients = [FieldElement(random.randint(1, prime-1), prime) for _ in range(degree)]
+        rng = rng or RandomnessProvider.default()
+        coefficients = rng.field_elements(degree, prime, low=1)
         return coefficients 
     
     def commit_coefficients(self, coefficients: List[FieldElement], g: FieldElement) -> List[FieldElement]:
         """Generate a homomorphic commitment for the given coefficients from a generator g.
+        g should be an element of a multiplicative group of prime field p (different from self.prime). The order of g should be self.prime.
         """
+        table = FixedBasePowerTable.for_element(g, self.prime)
         commitments = []
-        commitments.append(g ** self.secret.num)
+        commitments.append(table.pow(self.secret.num))
         for coefficient in coefficients:
-            commitments.append(g ** coefficient.num)
+            commitments.append(table.pow(coefficient.num))
         return commitments
     
     def commit_coefficients_ec(self, coefficients: List[FieldElement], g: S256Point) -> List[S256Point]:
@@ -256,10 +810,12 @@ class ShamirSecretSharing:
         """Verify that the user share is a valid share for the given commitment generated by the dealer"""
         i, s_i = share
 
-        left_side = g ** int(s_i.num)
-        right_side = commitments[0]
-        for j in range(1, len(commitments)):
-            right_side *= commitments[j] ** (i.num ** j)
+        left_side = FixedBasePowerTable.for_element(g, self.prime).pow(s_i.num)
+        # the exponents live in the group of order self.prime, so the powers of i are reduced as they are computed
+        exponents = [1]
+        for _ in range(1, len(commitments)):
+            exponents.append(exponents[-1] * i.num % self.prime)
+        right_side = FieldElement.multi_pow(commitments, exponents)
         return left_side == right_side
         
     def verify_share_ec (self, share: Tuple[FieldElement, FieldElement], commitments: List[S256Point], g: S256Point) -> bool:
@@ -273,6 +829,68 @@ class ShamirSecretSharing:
             right_side += (i.num ** j) * commitments[j]
         return left_side == right_side
 
+    def split_secret_pedersen(self) -> Tuple[List[Tuple[FieldElement, FieldElement, FieldElement]], List[FieldElement], List[FieldElement]]:
+        """Split the secret into N shares for Pedersen's Verifiable Secret Sharing scheme.
+        Next to the secret polynomial f(x), the dealer samples a random blinding polynomial r(x) of the same degree. Each share is a tuple (x, f(x), r(x)).
+        Returns the shares, the coefficients of f(x) (without the secret) and all the t coefficients of r(x).
+        """
+        coefficients = self.generate_coefficients(self.t, self.prime, self.rng)
+        blinding_coefficients = self.generate_coefficients(self.t + 1, self.prime, self.rng)
+        shares = []
+        for i in range(1, self.N + 1):
+            x = FieldElement(i, self.prime)
+            s_i = self.evaluate_polynomial(self.secret, coefficients, x)
+            r_i = self.evaluate_polynomial(blinding_coefficients[0], blinding_coefficients[1:], x)
+            shares.append((x, s_i, r_i))
+        return shares, coefficients, blinding_coefficients
+
+    def commit_coefficients_pedersen(self, coefficients: List[FieldElement], blinding_coefficients: List[FieldElement], g: S256Point = G, h: S256Point = H) -> List[S256Point]:
+        """Generate a Pedersen commitment a_j * g + b_j * h for each coefficient a_j of the secret polynomial and b_j of the blinding polynomial.
+        Unlike Feldman's commitments, the first commitment does not reveal secret * g. The order of g and h should be self.prime.
+        """
+        table_g = FixedBaseTable.for_point(g, self.prime)
+        table_h = FixedBaseTable.for_point(h, self.prime)
+        commitments = []
+        for a_j, b_j in zip([self.secret] + coefficients, blinding_coefficients):
+            commitments.append(table_h.mul(b_j.num, table_g.mul(a_j.num)))
+        return commitments
+
+    def verify_share_pedersen(self, share: Tuple[FieldElement, FieldElement, FieldElement], commitments: List[S256Point], g: S256Point = G, h: S256Point = H) -> bool:
+        """Verify that the user share (i, s_i, r_i) is consistent with the Pedersen commitments, namely s_i * g + r_i * h == sum(i^j * C_j)"""
+        i, s_i, r_i = share
+        table_g = FixedBaseTable.for_point(g, self.prime)
+        table_h = FixedBaseTable.for_point(h, self.prime)
+        left_side = table_h.mul(r_i.num, table_g.mul(s_i.num))
+        # Horner's rule keeps the scalars as small as i
+        right_side = commitments[-1]
+        for commitment in reversed(commitments[:-1]):
+            right_side = i.num * right_side + commitment
+        return left_side == right_side
+
+    def verify_shares_pedersen(self, shares: List[Tuple[FieldElement, FieldElement, FieldElement]], commitments: List[S256Point], g: S256Point = G, h: S256Point = H) -> bool:
+        """Verify many shares at once against the same Pedersen commitments.
+        The shares are combined with random weights w_k, so a single check (sum w_k * s_k) * g + (sum w_k * r_k) * h == sum((sum w_k * i_k^j) * C_j) replaces one check per share.
+        A batch containing an invalid share passes with negligible probability, as long as the weights cannot be predicted by the dealer.
+        Raises a ValueError if there are no shares or no commitments.
+        """
+        if not shares or not commitments:
+            raise ValueError('At least one share and one commitment are required')
+        table_g = FixedBaseTable.for_point(g, self.prime)
+        table_h = FixedBaseTable.for_point(h, self.prime)
+        s_sum, r_sum = 0, 0
+        scalars = [0] * len(commitments)
+        for i, s_i, r_i in shares:
+            weight = secrets.randbits(128)
+            s_sum += weight * s_i.num
+            r_sum += weight * r_i.num
+            power = weight
+            for j in range(len(commitments)):
+                scalars[j] = (scalars[j] + power) % self.prime
+                power = power * i.num % self.prime
+        left_side = table_h.mul(r_sum, table_g.mul(s_sum))
+        right_side = S256Point.multi_scalar_mul(scalars, commitments)
+        return left_side == right_side
+
         
     @staticmethod
     def evaluate_polynomial(secret: FieldElement, coefficients: List[FieldElement], x: FieldElement) -> FieldElement:
@@ -287,7 +905,7 @@ class ShamirSecretSharing:
         The ID should be different than 0, as it would reveal the secret. Remember that the secret is the evaluation of the reconstructed polynomial at x = 0.
         Also no two users should have the same ID.
         """
-        coefficients = self.generate_coefficients(self.t, self.prime)
+        coefficients = self.generate_coefficients(self.t, self.prime, self.rng)
         shares = [(FieldElement(i, self.prime), self.evaluate_polynomial(self.secret, coefficients, FieldElement(i, self.prime))) for i in range(1, self.N + 1)]
         return shares, coefficients
     
@@ -349,6 +967,133 @@ class ShamirSecretSharing:
 
         return secret
     
+from typing import BinaryIO
+
+class StreamingSecretSharing:
+    """Object to perform t out of N Shamir Secret Sharing of arbitrary byte streams, such as files or long keys.
+    The payload is split into chunks small enough to fit in the field and every chunk is shared with its own random polynomial, all evaluated at the same points x = 1, ..., N.
+    Each party receives a share stream made of a header with its x value followed by one fixed width share per chunk.
+    Chunks are processed in batches, so memory usage does not depend on the size of the payload.
+    """
+
+    def __init__(self, t: int, N: int, prime: int, batch_size: int = 1024, rng: RandomnessProvider = None):
+        """Initialize the object of t out of N threshold sharing byte streams in the finite field of order prime.
+        The coefficients are drawn from rng, or from the default RandomnessProvider if rng is None.
+        """
+        assert t <= N
+        # every chunk must be a field element, so it has strictly fewer bits than the prime
+        self.chunk_size = (prime.bit_length() - 1) // 8
+        if self.chunk_size < 1:
+            raise ValueError('prime must be at least 257 to share byte streams')
+        self.share_size = (prime.bit_length() + 7) // 8
+        self.t = t
+        self.N = N
+        self.prime = prime
+        self.batch_size = batch_size
+        self.rng = rng
+        self._lagrange_cache = {}
+
+    @staticmethod
+    def _read_block(stream: BinaryIO, size: int) -> bytes:
+        """Read exactly size bytes from the stream unless it ends first"""
+        data = stream.read(size)
+        while data and len(data) < size:
+            more = stream.read(size - len(data))
+            if not more:
+                break
+            data += more
+        return data
+
+    def _write_shares(self, chunks: List[int], powers: List[List[int]], sinks: List[BinaryIO]):
+        """Share a batch of chunks and append the shares to the share stream of each party"""
+        degree = self.t - 1
+        rng = self.rng or RandomnessProvider.default()
+        coefficients = [value + 1 for value in rng.randbelow_many(self.prime - 1, degree * len(chunks))]
+        polynomials = [[chunk] + coefficients[k * degree:(k + 1) * degree] for k, chunk in enumerate(chunks)]
+        for x_powers, sink in zip(powers, sinks):
+            # reduce once per share instead of once per term
+            values = [sum(c * p for c, p in zip(polynomial, x_powers)) % self.prime for polynomial in polynomials]
+            sink.write(b''.join(value.to_bytes(self.share_size, 'big') for value in values))
+
+    def split_stream(self, source: BinaryIO, sinks: List[BinaryIO]):
+        """Read the payload from the source stream and write the share stream of party i to sinks[i - 1].
+        The payload is padded with a 0x80 byte followed by zeros up to a multiple of the chunk size, so that recovery can restore its exact length.
+        """
+        if len(sinks) != self.N:
+            raise ValueError('Expected {} share streams, got {}'.format(self.N, len(sinks)))
+        powers = []
+        for i, sink in enumerate(sinks, start=1):
+            sink.write(i.to_bytes(self.share_size, 'big'))
+            powers.append([pow(i, j, self.prime) for j in range(self.t)])
+
+        block_size = self.chunk_size * self.batch_size
+        buffer = b''
+        done = False
+        while not done:
+            data = self._read_block(source, block_size)
+            buffer += data
+            if len(data) < block_size:
+                buffer += b'\x80'
+                buffer += b'\x00' * (-len(buffer) % self.chunk_size)
+                done = True
+            usable = len(buffer) - len(buffer) % self.chunk_size
+            chunks = [int.from_bytes(buffer[k:k + self.chunk_size], 'big') for k in range(0, usable, self.chunk_size)]
+            buffer = buffer[usable:]
+            if chunks:
+                self._write_shares(chunks, powers, sinks)
+
+    def lagrange_coefficients(self, x_values: List[int]) -> List[int]:
+        """Return the Lagrange coefficients that interpolate the polynomial at x = 0 from its values at x_values, caching them for the next calls"""
+        key = tuple(x_values)
+        if key not in self._lagrange_cache:
+            coefficients = []
+            for i, x_i in enumerate(x_values):
+                num, den = 1, 1
+                for j, x_j in enumerate(x_values):
+                    if i == j:
+                        continue
+                    num = num * -x_j % self.prime
+                    den = den * (x_i - x_j) % self.prime
+                coefficients.append(num * pow(den, self.prime - 2, self.prime) % self.prime)
+            self._lagrange_cache[key] = coefficients
+        return self._lagrange_cache[key]
+
+    def recover_stream(self, sources: List[BinaryIO], sink: BinaryIO):
+        """Recover the payload from at least t share streams and write it to the sink stream"""
+        if len(sources) < self.t:
+            raise ValueError("Not enough shares to recover the secret")
+        sources = sources[:self.t]
+        x_values = [int.from_bytes(self._read_block(source, self.share_size), 'big') for source in sources]
+        if len(set(x_values)) != self.t or 0 in x_values:
+            raise ValueError('Share streams must come from different parties')
+        weights = self.lagrange_coefficients(x_values)
+
+        block_size = self.share_size * self.batch_size
+        previous = None
+        while True:
+            blocks = [self._read_block(source, block_size) for source in sources]
+            if any(len(block) != len(blocks[0]) or len(block) % self.share_size for block in blocks):
+                raise ValueError('Share streams are truncated or have different lengths')
+            if not blocks[0]:
+                break
+            chunks = []
+            for k in range(0, len(blocks[0]), self.share_size):
+                chunk = sum(w * int.from_bytes(block[k:k + self.share_size], 'big') for w, block in zip(weights, blocks)) % self.prime
+                if chunk.bit_length() > 8 * self.chunk_size:
+                    raise ValueError('Share streams are inconsistent')
+                chunks.append(chunk.to_bytes(self.chunk_size, 'big'))
+            # hold back the last batch, as it contains the padding
+            if previous is not None:
+                sink.write(previous)
+            previous = b''.join(chunks)
+
+        if previous is None:
+            raise ValueError('Share streams are empty')
+        payload = previous.rstrip(b'\x00')
+        if not payload.endswith(b'\x80'):
+            raise ValueError('Invalid padding in the recovered payload')
+        sink.write(payload[:-1])
+
 class DistributedKeyGeneration:
 
     def __init__(self, t, N, prime):
@@ -424,41 +1169,127 @@ class DistributedKeyGenerationMember:
     #     # Considering a share inside shares, add together all the second element of the share tuple
     #     self.private_share = sum([share[1] for share in self.shares])
 
-import math
-from sympy import mod_inverse
-
 class RSA:
 
     """
         Class to generate RSA keys, perform encryption and decryption
     """
 
-    def __init__(self, p: int, q: int):
-        """Initialize the RSA object"""
-        assert RSA.is_prime(p), "p is not prime"
-        assert RSA.is_prime(q), "q is not prime"
+    # Small public exponent that makes encryption much cheaper than decryption
+    DEFAULT_PUBLIC_EXPONENT = 65537
+
+    def __init__(self, p: int, q: int, rng: RandomnessProvider = None, check_primes: bool = True, public_exponent: int = None):
+        """Initialize the RSA object. If public_exponent is None, the public exponent is drawn from rng, or from the default RandomnessProvider if rng is None.
+        check_primes can be set to False when p and q are already known to be prime, as the check is expensive for large primes.
+        """
+        assert not check_primes or RSA.is_prime(p), "p is not prime"
+        assert not check_primes or RSA.is_prime(q), "q is not prime"
         assert p != q, "p and q should be different"
         self.p = p
         self.q = q
         self.n = p * q
         self.key_size = self.n.bit_length()
         self.phi = (p - 1) * (q - 1)
-        self.public_key = self.generate_public_key()
+        self.rng = rng or RandomnessProvider.default()
+        if public_exponent is None:
+            self.public_key = self.generate_public_key()
+        elif RSA.gcd(public_exponent, self.phi) != 1:
+            raise ValueError('public exponent {} is not coprime with phi(n)'.format(public_exponent))
+        else:
+            self.public_key = public_exponent
         self.private_key = self.generate_private_key(self.public_key)
+        # Chinese Remainder Theorem parameters for decryption
+        self.dp = self.private_key % (p - 1)
+        self.dq = self.private_key % (q - 1)
+        self.q_inv = pow(q, -1, p)
+
 
+    # Odd primes below 2000, used to sieve candidates before running Miller-Rabin
+    SMALL_PRIMES = [p for p in range(3, 2000, 2) if all(p % d for d in range(3, int(p**0.5) + 1, 2))]
+    # Miller-Rabin with the first 13 primes as bases is deterministic below this bound
+    DETERMINISTIC_BOUND = 3317044064679887385961981
+    DETERMINISTIC_BASES = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41]
 
     @staticmethod
-    def is_prime(n: int) -> bool:
-        """Check if a number is prime"""
-        if n == 2:
-            return True
-        if n % 2 == 0 or n <= 1:
+    def is_prime(n: int, rounds: int = 40, rng: RandomnessProvider = None) -> bool:
+        """Check if a number is prime.
+        Small factors are ruled out by trial division by the primes below 2000, then the Miller-Rabin test is run.
+        The test is deterministic for n < 3.3 * 10^24 and uses `rounds` random bases beyond, with an error probability below 4^-rounds.
+        """
+        if n < 2:
             return False
-        sqr = int(math.sqrt(n)) + 1
-        for divisor in range(3, sqr, 2):
-            if n % divisor == 0:
+        for p in [2] + RSA.SMALL_PRIMES:
+            if n % p == 0:
+                return n == p
+        if n < 2000**2:
+            return True
+        d = n - 1
+        s = 0
+        while d % 2 == 0:
+            d //= 2
+            s += 1
+        if n < RSA.DETERMINISTIC_BOUND:
+            bases = RSA.DETERMINISTIC_BASES
+        else:
+            rng = rng or RandomnessProvider.default()
+            bases = [2 + value for value in rng.randbelow_many(n - 3, rounds)]
+        for a in bases:
+            x = pow(a, d, n)
+            if x == 1 or x == n - 1:
+                continue
+            for _ in range(s - 1):
+                x = x * x % n
+                if x == n - 1:
+                    break
+            else:
                 return False
         return True
+
+    @staticmethod
+    def generate_prime(bits: int, rng: RandomnessProvider = None, condition=None) -> int:
+        """Generate a random prime of exactly `bits` bits, with the two most significant bits set so that the product of two such primes has exactly 2 * bits bits.
+        Starting from a random odd candidate, a window of consecutive odd numbers is sieved by the small primes and only the survivors are tested with Miller-Rabin.
+        If `condition` is given, only primes p for which condition(p) is True are returned.
+        """
+        if bits < 3:
+            raise ValueError('bits must be at least 3')
+        rng = rng or RandomnessProvider.default()
+        # Random candidates need far fewer rounds than adversarial inputs for the same error probability (FIPS 186-4, table C.3)
+        rounds = 4 if bits >= 1536 else 5 if bits >= 1024 else 7 if bits >= 512 else 40
+        window = 4 * bits
+        while True:
+            candidate = rng.randbits(bits) | (3 << (bits - 2)) | 1
+            # sieve[k] is False if candidate + 2k has a small prime factor
+            sieve = [True] * window
+            for p in RSA.SMALL_PRIMES:
+                if p >= candidate:
+                    break
+                # first k such that candidate + 2k = 0 mod p
+                start = (-candidate * (p + 1) // 2) % p
+                sieve[start::p] = [False] * len(range(start, window, p))
+            for k in range(window):
+                if not sieve[k]:
+                    continue
+                p = candidate + 2 * k
+                if p.bit_length() != bits:
+                    break
+                if (condition is None or condition(p)) and RSA.is_prime(p, rounds, rng):
+                    return p
+
+    @classmethod
+    def generate(cls, bits: int = 2048, rng: RandomnessProvider = None, public_exponent: int = DEFAULT_PUBLIC_EXPONENT) -> 'RSA':
+        """Generate an RSA object with a modulus of exactly `bits` bits from two random primes.
+        The primes are chosen so that public_exponent is a valid public key. If public_exponent is None, a random public key is drawn instead.
+        """
+        rng = rng or RandomnessProvider.default()
+        condition = None
+        if public_exponent is not None:
+            condition = lambda prime: RSA.gcd(public_exponent, prime - 1) == 1
+        p = RSA.generate_prime(bits - bits // 2, rng, condition)
+        q = RSA.generate_prime(bits // 2, rng, condition)
+        while q == p:
+            q = RSA.generate_prime(bits // 2, rng, condition)
+        return cls(p, q, rng, check_primes=False, public_exponent=public_exponent)
     
     @staticmethod
     def gcd(a, b):
@@ -468,15 +1299,15 @@ class RSA:
         return a
     
     def generate_public_key(self):
-        e = random.randint(1, self.phi)
+        e = self.rng.randint(1, self.phi)
         g = RSA.gcd(e, self.phi)
         while g != 1:
-            e = random.randint(1, self.phi)
+            e = self.rng.randint(1, self.phi)
             g = RSA.gcd(e, self.phi)
         return e
 
     def generate_private_key(self, e):
-        d = mod_inverse(e, self.phi)
+        d = pow(e, -1, self.phi)
         return d
 
     def encrypt(self, message: int) -> int:
@@ -485,12 +1316,37 @@ class RSA:
     
     def decrypt(self, message: int) -> int:
         """Decrypt the message using the private key"""
-        return pow(message, self.private_key, self.n)
+        return RSA.decrypt_crt(message, self.p, self.q, self.dp, self.dq, self.q_inv)
 
-import os
-import sys
+    @staticmethod
+    def decrypt_crt(message: int, p: int, q: int, dp: int, dq: int, q_inv: int) -> int:
+        """Decrypt the message with two exponentiations modulo p and q, with half size exponents, combined with Garner's formula.
+        This is about 4 times faster than a single exponentiation modulo n.
+        """
+        m_p = pow(message, dp, p)
+        m_q = pow(message, dq, q)
+        h = q_inv * (m_p - m_q) % p
+        return m_q + h * q
+
+    @staticmethod
+    def _map(function, messages: List[int], arguments: tuple, processes: int) -> List[int]:
+        """Apply function(message, *arguments) to every message, across a pool of processes if processes > 1"""
+        if processes <= 1 or len(messages) < 2:
+            return [function(message, *arguments) for message in messages]
+        from concurrent.futures import ProcessPoolExecutor
+        from itertools import repeat
+        chunksize = max(1, len(messages) // (4 * processes))
+        columns = [repeat(argument) for argument in arguments]
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            return list(executor.map(function, messages, *columns, chunksize=chunksize))
 
-from sympy import randprime
+    def encrypt_many(self, messages: List[int], processes: int = 1) -> List[int]:
+        """Encrypt many messages using the public key, across a pool of processes if processes > 1"""
+        return RSA._map(pow, messages, (self.public_key, self.n), processes)
+
+    def decrypt_many(self, messages: List[int], processes: int = 1) -> List[int]:
+        """Decrypt many messages using the private key, across a pool of processes if processes > 1"""
+        return RSA._map(RSA.decrypt_crt, messages, (self.p, self.q, self.dp, self.dq, self.q_inv), processes)
 
 class TimeLockPuzzle:
 
@@ -499,68 +1355,169 @@ class TimeLockPuzzle:
         based on https://github.com/drummerjolev/time-lock-puzzle
     """
 
+    # Key size in bytes. The key must be smaller than the modulus
+    KEY_SIZE = 32
+
     @staticmethod
-    def encrypt(message: int, seconds: int, squarings_per_second: int) -> Tuple[int, int, int, int, int, int, int, int]:
+    def encrypt(message: bytes, seconds: int, squarings_per_second: int = None, bits: int = 2048, rng: RandomnessProvider = None) -> Tuple[int, int, int, int, int, int, bytes, int]:
+        """Encrypt the message so that it can only be decrypted after t = seconds * squarings_per_second sequential squarings modulo an RSA modulus of `bits` bits.
+        If squarings_per_second is None, it is measured on this machine with TimeLockSolver.calibrate.
+        The message is encrypted with a random key, and the key is locked by adding a^(2^t) mod n to it.
+        Knowing phi(n), the creator computes a^(2^t) mod n as a^(2^t mod phi(n)) mod n with O(log t) work.
+        Returns p, q, n, a, t, the encrypted key, the encrypted message and the key.
+        """
+        if bits <= 8 * TimeLockPuzzle.KEY_SIZE:
+            raise ValueError('bits must be larger than {}'.format(8 * TimeLockPuzzle.KEY_SIZE))
+        rng = rng or RandomnessProvider.default()
+        if squarings_per_second is None:
+            squarings_per_second = TimeLockSolver.calibrate(bits)
 
-        p = randprime(0, 200)
-        q = randprime(0, 200)
-        # if p == q, need to regenerate
-        while p == q:
-            p = randprime(0, 200)
-            q = randprime(0, 200)
-        rsa = RSA(p, q)
+        rsa = RSA.generate(bits, rng)
 
-        # perform encryption using XOR
-        key_int = random.randint(1, 5000)
-        encrypted_message = Utils.xor(message, key_int)
+        # perform encryption using XOR with a key stream derived from the key
+        key = rng.random_bytes(TimeLockPuzzle.KEY_SIZE)
+        key_int = int.from_bytes(key, 'big')
+        encrypted_message = Utils.xor_bytes(message, TimeLockPuzzle.key_stream(key_int, len(message)))
 
         # Pick safe, pseudo-random a where 1 < a < n
-        a = int.from_bytes(os.urandom(32), sys.byteorder) % rsa.n + 1
+        a = rng.randint(2, rsa.n - 1)
 
         # Time lock key encryption
         t = seconds * squarings_per_second
-        e = 2**t % rsa.phi
-        b = TimeLockPuzzle.fast_exponentiation(rsa.n, a, e)
+        e = pow(2, t, rsa.phi)
+        b = pow(a, e, rsa.n)
 
-        encrypted_key = (key_int % rsa.n + b) % rsa.n
+        encrypted_key = (key_int + b) % rsa.n
         return rsa.p, rsa.q, rsa.n, a, t, encrypted_key, encrypted_message, key_int
 
     @staticmethod
-    def fast_exponentiation(n: int, g: int, x: int) -> int:
-        # reverses binary string
-        binary = bin(x)[2:][::-1]
-        squares = TimeLockPuzzle.successive_squares(g, n, len(binary))
-        # keeps positive powers of two
-        factors = [tup[1] for tup in zip(binary, squares) if tup[0] == '1']
-        acc = 1
-        for factor in factors:
-            acc = acc * factor % n
-        return acc
-
-    @staticmethod
-    def successive_squares(base: int, mod: int, length: int) -> list[int]:
-        table = [base % mod]
-        prev = base % mod
-        for _ in range(1, length):
-            squared = prev**2 % mod
-            table.append(squared)
-            prev = squared
-        return table
+    def key_stream(key: int, length: int) -> bytes:
+        """Expand the key into a stream of length bytes with SHAKE-256"""
+        key_bytes = key.to_bytes(TimeLockPuzzle.KEY_SIZE, 'big')
+        return hashlib.shake_256(b'tomaquet-ecc-time-lock' + key_bytes).digest(length)
     
     @staticmethod
-    def decrypt(n: int, a: int, t: int, enc_key: int, enc_message: int) -> bytes:
+    def decrypt(n: int, a: int, t: int, enc_key: int, enc_message: bytes, solver: 'TimeLockSolver' = None) -> bytes:
+        """Decrypt the message by performing the t sequential squarings, with the given solver to checkpoint or report progress"""
         # Successive squaring to find b
         # We assume this cannot be parallelized
-        b = a % n
-        for _ in range(t):
-            b = b**2 % n
+        b = (solver or TimeLockSolver()).solve(n, a, t)
+        return TimeLockPuzzle.unlock(n, b, enc_key, enc_message)
+
+    @staticmethod
+    def unlock(n: int, b: int, enc_key: int, enc_message: bytes) -> bytes:
+        """Decrypt the message given b = a^(2^t) mod n"""
         dec_key = (enc_key - b) % n
+        if dec_key.bit_length() > 8 * TimeLockPuzzle.KEY_SIZE:
+            raise ValueError('The puzzle parameters do not match the encrypted key')
 
         # Retrieve key, decrypt message
-        return Utils.xor(enc_message, dec_key)
+        return Utils.xor_bytes(enc_message, TimeLockPuzzle.key_stream(dec_key, len(enc_message)))
 
+import json
+import time
+
+class TimeLockSolver:
+
+    """
+        Class to solve time lock puzzles by sequential squaring.
+        The solver can periodically save its state (iteration, b) to a checkpoint file, resume from it after a restart and report its progress to a callback.
+    """
+
+    def __init__(self, checkpoint_path: str = None, checkpoint_interval: int = 10**6, progress=None, progress_interval: int = 10**5):
+        """Initialize the solver.
+        If checkpoint_path is given, the state is saved there every checkpoint_interval squarings and solving resumes from it if it exists.
+        If progress is given, progress(iteration, t) is called every progress_interval squarings and when the last squaring is done.
+        """
+        if checkpoint_interval < 1 or progress_interval < 1:
+            raise ValueError('intervals must be positive')
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.progress = progress
+        self.progress_interval = progress_interval
+
+    @staticmethod
+    def calibrate(bits: int = 2048, duration: float = 1.0, rng: RandomnessProvider = None) -> int:
+        """Measure how many squarings modulo a `bits` bits modulus this machine performs per second"""
+        rng = rng or RandomnessProvider.default()
+        # the speed of squaring does not depend on the factorization, so any odd modulus of the right size will do
+        n = rng.randbits(bits) | (1 << (bits - 1)) | 1
+        b = rng.randint(2, n - 1)
+        squarings = 0
+        batch = 1000
+        start = time.perf_counter()
+        elapsed = 0.0
+        while elapsed < duration:
+            for _ in range(batch):
+                b = b * b % n
+            squarings += batch
+            elapsed = time.perf_counter() - start
+        return max(1, int(squarings / elapsed))
+
+    def load_checkpoint(self, n: int, a: int, t: int) -> Tuple[int, int]:
+        """Return the (iteration, b) saved in the checkpoint file, or (0, a mod n) if there is none"""
+        if self.checkpoint_path is None or not os.path.exists(self.checkpoint_path):
+            return 0, a % n
+        with open(self.checkpoint_path) as f:
+            state = json.load(f)
+        if (int(state['n'], 16), int(state['a'], 16), state['t']) != (n, a, t):
+            raise ValueError('Checkpoint {} belongs to a different puzzle'.format(self.checkpoint_path))
+        return state['iteration'], int(state['b'], 16)
+
+    def save_checkpoint(self, n: int, a: int, t: int, iteration: int, b: int):
+        """Atomically save the state of the solver to the checkpoint file"""
+        state = {'n': '{:x}'.format(n), 'a': '{:x}'.format(a), 't': t, 'iteration': iteration, 'b': '{:x}'.format(b)}
+        temporary_path = self.checkpoint_path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, self.checkpoint_path)
+
+    def solve(self, n: int, a: int, t: int) -> int:
+        """Compute a^(2^t) mod n with t sequential squarings, resuming from the checkpoint if there is one"""
+        iteration, b = self.load_checkpoint(n, a, t)
+        next_checkpoint = iteration + self.checkpoint_interval
+        next_progress = iteration + self.progress_interval
+        while iteration < t:
+            stop = min(t, next_checkpoint, next_progress)
+            for _ in range(stop - iteration):
+                b = b * b % n
+            iteration = stop
+            if iteration == next_checkpoint:
+                if self.checkpoint_path is not None:
+                    self.save_checkpoint(n, a, t, iteration, b)
+                next_checkpoint += self.checkpoint_interval
+            if iteration == next_progress or iteration == t:
+                if self.progress is not None:
+                    self.progress(iteration, t)
+                next_progress = iteration + self.progress_interval
+        if self.checkpoint_path is not None:
+            self.save_checkpoint(n, a, t, iteration, b)
+        return b
+
+    @staticmethod
+    def _solve_puzzle(puzzle: Tuple[int, int, int, int, bytes], checkpoint_path: str, checkpoint_interval: int) -> bytes:
+        """Solve a single puzzle (n, a, t, encrypted key, encrypted message). Defined at class level so that it can be sent to worker processes"""
+        n, a, t, enc_key, enc_message = puzzle
+        solver = TimeLockSolver(checkpoint_path, checkpoint_interval)
+        return TimeLockPuzzle.decrypt(n, a, t, enc_key, enc_message, solver)
+
+    @staticmethod
+    def solve_many(puzzles: List[Tuple[int, int, int, int, bytes]], processes: int = 1, checkpoint_dir: str = None, checkpoint_interval: int = 10**6) -> List[bytes]:
+        """Decrypt many independent puzzles (n, a, t, encrypted key, encrypted message), across a pool of processes if processes > 1.
+        If checkpoint_dir is given, puzzle i is checkpointed to checkpoint_dir/puzzle-i.json.
+        """
+        checkpoint_paths = [None] * len(puzzles)
+        if checkpoint_dir is not None:
+            checkpoint_paths = [os.path.join(checkpoint_dir, 'puzzle-{}.json'.format(i)) for i in range(len(puzzles))]
+        intervals = [checkpoint_interval] * len(puzzles)
+        if processes <= 1 or len(puzzles) < 2:
+            return list(map(TimeLockSolver._solve_puzzle, puzzles, checkpoint_paths, intervals))
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            return list(executor.map(TimeLockSolver._solve_puzzle, puzzles, checkpoint_paths, intervals))
 
-import hashlib
 
 class Utils: 
 
@@ -574,3 +1531,152 @@ class Utils:
     @staticmethod
     def xor(input:int, key: int):
         return input ^ key
+
+    @staticmethod
+    def xor_bytes(data: bytes, key_stream: bytes) -> bytes:
+        """XOR the data with a key stream of the same length"""
+        if len(data) != len(key_stream):
+            raise ValueError('data and key stream must have the same length')
+        return (int.from_bytes(data, 'big') ^ int.from_bytes(key_stream, 'big')).to_bytes(len(data), 'big')
+
+
+import contextvars
+import functools
+
+class OperationCounter:
+
+    """
+        Opt-in instrumentation of the field and curve arithmetic.
+        Inside a `with OperationCounter() as counter:` block, FieldElement multiplications, inversions and exponentiations and Point additions and doublings are counted.
+        With timings=True, the wall time of each public API call is also recorded in a histogram, together with the operations it performed.
+        The methods are only wrapped inside the block, so the arithmetic runs at full speed when no counter is active.
+        Only the operations performed in the context (thread or asyncio task) that entered the block are counted; other threads are not.
+        The wrapping itself is process-wide, so only one counter can be active at a time.
+        Arithmetic done directly on integers, such as FieldElement.multi_pow or RSA, is not counted.
+    """
+
+    OPERATIONS = ['field_mul', 'field_inv', 'field_pow', 'point_add', 'point_double']
+    # Upper bounds in seconds of the buckets of the wall time histograms
+    BUCKETS = [1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0, 10.0, float('inf')]
+    TIMED_APIS = [
+        (KeyPair, '__init__'), (KeyPair, 'generate_shared_secret'),
+        (ShamirSecretSharing, 'split_secret'), (ShamirSecretSharing, 'split_secret_pedersen'),
+        (ShamirSecretSharing, 'commit_coefficients'), (ShamirSecretSharing, 'commit_coefficients_ec'), (ShamirSecretSharing, 'commit_coefficients_pedersen'),
+        (ShamirSecretSharing, 'verify_share'), (ShamirSecretSharing, 'verify_share_ec'), (ShamirSecretSharing, 'verify_share_pedersen'), (ShamirSecretSharing, 'verify_shares_pedersen'),
+        (ShamirSecretSharing, 'lagrange_interp'), (ShamirSecretSharing, 'lagrange_interp_ec'),
+        (ShamirSecretSharing, 'recover_secret'), (ShamirSecretSharing, 'recover_secret_ec'),
+        (DistributedKeyGeneration, 'kick_off_ceremony'),
+    ]
+
+    _active = None
+    # The counter that counts in the current context, and whether it is suspended inside a wrapped method
+    _current = contextvars.ContextVar('operation_counter', default=None)
+    _suspended = contextvars.ContextVar('operation_counter_suspended', default=False)
+
+    def __init__(self, timings: bool = False):
+        """Initialize the counter. If timings is True, the public APIs are timed as well"""
+        self.timings = timings
+        self.counts = dict.fromkeys(self.OPERATIONS, 0)
+        self.apis = {}
+        self._originals = []
+        self._token = None
+
+    def _counting(self) -> bool:
+        return OperationCounter._current.get() is self and not OperationCounter._suspended.get()
+
+    def _count(self, operation: str):
+        if self._counting():
+            self.counts[operation] += 1
+
+    def _patch(self, cls, name: str, wrapper):
+        self._originals.append((cls, name, cls.__dict__[name]))
+        setattr(cls, name, wrapper)
+
+    def _wrap_field(self, name: str, operations: List[str]):
+        original = FieldElement.__dict__[name]
+        counter = self
+        @functools.wraps(original)
+        def wrapper(*args):
+            if not counter._counting():
+                return original(*args)
+            for operation in operations:
+                counter._count(operation)
+            # the operations performed by the original method itself are already accounted for
+            token = OperationCounter._suspended.set(True)
+            try:
+                return original(*args)
+            finally:
+                OperationCounter._suspended.reset(token)
+        self._patch(FieldElement, name, wrapper)
+
+    def _wrap_point_add(self):
+        original = Point.__dict__['__add__']
+        counter = self
+        @functools.wraps(original)
+        def wrapper(point, other):
+            if point.x is not None and other.x is not None:
+                counter._count('point_double' if point == other else 'point_add')
+            return original(point, other)
+        self._patch(Point, '__add__', wrapper)
+
+    def _wrap_api(self, cls, name: str):
+        original = cls.__dict__[name]
+        counter = self
+        api = '{}.{}'.format(cls.__name__, name)
+        @functools.wraps(original)
+        def wrapper(*args, **kwargs):
+            if OperationCounter._current.get() is not counter:
+                return original(*args, **kwargs)
+            before = dict(counter.counts)
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                counter._record(api, time.perf_counter() - start, before)
+        self._patch(cls, name, wrapper)
+
+    def _record(self, api: str, elapsed: float, before: dict):
+        stats = self.apis.setdefault(api, {
+            'calls': 0, 'total_time': 0.0,
+            'histogram': dict.fromkeys([str(bound) for bound in self.BUCKETS], 0),
+            'operations': dict.fromkeys(self.OPERATIONS, 0),
+        })
+        stats['calls'] += 1
+        stats['total_time'] += elapsed
+        for bound in self.BUCKETS:
+            if elapsed <= bound:
+                stats['histogram'][str(bound)] += 1
+                break
+        for operation in self.OPERATIONS:
+            stats['operations'][operation] += self.counts[operation] - before[operation]
+
+    def __enter__(self) -> 'OperationCounter':
+        if OperationCounter._active is not None:
+            raise RuntimeError('Another OperationCounter is already active')
+        OperationCounter._active = self
+        self._token = OperationCounter._current.set(self)
+        self._wrap_field('__mul__', ['field_mul'])
+        self._wrap_field('__rmul__', ['field_mul'])
+        self._wrap_field('__pow__', ['field_pow'])
+        self._wrap_field('__truediv__', ['field_inv', 'field_mul'])
+        self._wrap_point_add()
+        if self.timings:
+            for cls, name in self.TIMED_APIS:
+                self._wrap_api(cls, name)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for cls, name, original in reversed(self._originals):
+            setattr(cls, name, original)
+        self._originals = []
+        OperationCounter._current.reset(self._token)
+        self._token = None
+        OperationCounter._active = None
+        return False
+
+    def as_dict(self) -> dict:
+        """Export the operation counts and, if timings are enabled, the statistics of each public API"""
+        result = dict(self.counts)
+        if self.timings:
+            result['apis'] = {api: {key: dict(value) if isinstance(value, dict) else value for key, value in stats.items()} for api, stats in self.apis.items()}
+        return result
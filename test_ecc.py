@@ -1,7 +1,13 @@
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
 import random
 
-from ecc import FieldElement, Point, S256Field, S256Point, G, N, KeyPair, ShamirSecretSharing, DistributedKeyGeneration, Utils, TimeLockPuzzle, RSA
+from ecc import FieldElement, Point, S256Field, S256Point, G, H, N, P, FixedBaseTable, LRUCache, FixedBasePowerTable, HashToCurve, KeyPair, RandomnessProvider, OperationCounter, ShamirSecretSharing, StreamingSecretSharing, DistributedKeyGeneration, Utils, TimeLockPuzzle, TimeLockSolver, RSA
 
 class ECCTest(unittest.TestCase):
 
@@ -18,6 +24,14 @@ class ECCTest(unittest.TestCase):
                 print(a[i] <= sum)
                 print(b[j] <= sum)
 
+    def test_import_is_light(self):
+        # importing ecc should not pull in sympy or pycryptodome
+        code = "import sys, ecc; print('sympy' in sys.modules, 'Crypto' in sys.modules)"
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        assert output.stdout.split() == ['False', 'False']
+        # the constants skip the on-curve check at import time, but they should be on the curve
+        S256Point(G.x.num, G.y.num)
+
     def test_on_curve(self):
         prime = 223
         a = FieldElement(0, prime)
@@ -204,6 +218,272 @@ class ECCTest(unittest.TestCase):
                 for share in shares:
                     assert sss.verify_share(share, commitments, generator)
 
+    def test_operation_counter(self):
+        prime = 223
+        a = FieldElement(3, prime)
+        b = FieldElement(5, prime)
+        mul = FieldElement.__mul__
+        with OperationCounter() as counter:
+            a * b
+            2 * a
+            a ** 3
+            a / b
+            # a division is one inversion and one multiplication, whatever it does internally
+            assert counter.as_dict() == {'field_mul': 3, 'field_inv': 1, 'field_pow': 1, 'point_add': 0, 'point_double': 0}
+
+            before = dict(counter.counts)
+            G + G
+            G + 2 * G
+            assert counter.counts['point_double'] - before['point_double'] == 3
+            assert counter.counts['point_add'] - before['point_add'] == 1
+
+            # Arithmetic in other threads is not counted
+            before = dict(counter.counts)
+            worker = threading.Thread(target=lambda: [a * b for _ in range(100)] + [G + G])
+            worker.start()
+            worker.join()
+            assert counter.counts == before
+
+            # Only one counter can be active at a time
+            with self.assertRaises(RuntimeError):
+                with OperationCounter():
+                    pass
+
+        # The original methods should be restored on exit
+        assert FieldElement.__mul__ is mul
+        counts = counter.as_dict()
+        a * b
+        assert counter.as_dict() == counts
+
+        with OperationCounter(timings=True) as counter:
+            KeyPair(12345)
+            KeyPair(67890)
+            # the wrappers keep the metadata of the wrapped methods
+            assert KeyPair.__init__.__qualname__ == 'KeyPair.__init__'
+            assert FieldElement.__mul__.__name__ == '__mul__'
+        stats = counter.as_dict()['apis']['KeyPair.__init__']
+        assert stats['calls'] == 2
+        assert sum(stats['histogram'].values()) == 2
+        assert stats['operations']['point_double'] > 0
+        assert stats['operations']['point_add'] == counter.counts['point_add']
+        assert KeyPair.__init__.__qualname__ == 'KeyPair.__init__'
+
+    def test_fixed_base_and_multi_scalar_mul(self):
+        table = FixedBaseTable.for_point(G)
+        for scalar in [0, 1, 15, 16, 2**255 + 12345, N - 1, N + 5]:
+            assert table.mul(scalar) == scalar * G
+
+        scalars = [random.randint(0, N - 1) for _ in range(3)] + [0]
+        points = [random.randint(1, N - 1) * G for _ in range(4)]
+        expected = S256Point(None, None)
+        for scalar, point in zip(scalars, points):
+            expected += scalar * point
+        assert S256Point.multi_scalar_mul(scalars, points) == expected
+
+    def test_fixed_base_power_and_multi_pow(self):
+        # 2 generates the subgroup of order q = 11 in the multiplicative group of the field of order p = 23
+        p, q = 23, 11
+        g = FieldElement(2, p)
+        table = FixedBasePowerTable.for_element(g, q)
+        for exponent in range(3 * q):
+            assert table.pow(exponent) == g ** exponent
+
+        bases = [FieldElement(random.randint(1, p - 1), p) for _ in range(4)]
+        exponents = [random.randint(0, 2**40) for _ in range(3)] + [0]
+        expected = FieldElement(1, p)
+        for base, exponent in zip(bases, exponents):
+            expected *= base ** exponent
+        assert FieldElement.multi_pow(bases, exponents) == expected
+
+        # ExpFeldman commitments in the subgroup of prime order q of the safe prime p = 2q + 1
+        q = 0x80000000000000000000000000001851
+        p = 2 * q + 1
+        g = FieldElement(4, p)
+        secret = FieldElement(random.randint(1, q - 1), q)
+        sss = ShamirSecretSharing(4, 6, secret)
+        shares, coefficients = sss.split_secret()
+        commitments = sss.commit_coefficients(coefficients, g)
+        assert commitments[0] == g ** secret.num
+        for share in shares:
+            assert sss.verify_share(share, commitments, g)
+        i, s_i = shares[0]
+        assert not sss.verify_share((i, s_i + FieldElement(1, q)), commitments, g)
+
+        # Should throw an error if the order of g does not divide the order of the secret field
+        with self.assertRaises(ValueError):
+            sss.commit_coefficients(coefficients, FieldElement(p - 1, p) * g)
+
+    def test_hash_to_curve(self):
+        # Test vectors from RFC 9380, appendices K.1 and J.8.1
+        assert HashToCurve.expand_message_xmd(b'', b'QUUX-V01-CS02-with-expander-SHA256-128', 0x20).hex() == '68a985b87eb6b46952128911f2a4412bbc302a9d759667f87f7a21d803f07235'
+        dst = b'QUUX-V01-CS02-with-secp256k1_XMD:SHA-256_SSWU_RO_'
+        vectors = [
+            (b'', 0xc1cae290e291aee617ebaef1be6d73861479c48b841eaba9b7b5852ddfeb1346, 0x64fa678e07ae116126f08b022a94af6de15985c996c3a91b64c406a960e51067),
+            (b'abc', 0x3377e01eab42db296b512293120c6cee72b6ecf9f9205760bd9ff11fb3cb2c4b, 0x7f95890f33efebd1044d382a01b1bee0900fb6116f94688d487c6c7b9c8371f6),
+        ]
+        for message, x, y in vectors:
+            assert HashToCurve.hash_to_curve(message, dst) == S256Point(x, y)
+
+        # The batch mode should match the single message mode and give valid, distinct points
+        messages = [b'message %d' % i for i in range(20)] + [b'message 0']
+        points = HashToCurve.hash_to_curve_batch(messages)
+        assert points == [HashToCurve.hash_to_curve(message) for message in messages]
+        for point in points:
+            S256Point(point.x.num, point.y.num)
+        assert len({point.x.num for point in points}) == 20
+        for x, y in HashToCurve.map_to_curve_batch([0, 1, P - 1] + [random.randint(0, P - 1) for _ in range(20)]):
+            S256Point(x, y)
+
+        # The try and increment fallback should also give valid points
+        point = HashToCurve.try_and_increment(b'abc')
+        S256Point(point.x.num, point.y.num)
+
+    def test_pedersen_secret_sharing(self):
+        threshold = 3
+        n = 5
+        secret = FieldElement(random.randint(1, N - 1), N)
+        sss = ShamirSecretSharing(threshold, n, secret)
+
+        # H should be a valid point different from G, derived by hashing G
+        assert H != G
+        assert H == HashToCurve.try_and_increment(bytes.fromhex(KeyPair(1).public_key()), dst=b'tomaquet-ecc-pedersen-H')
+        S256Point(H.x.num, H.y.num)
+
+        shares, coefficients, blinding_coefficients = sss.split_secret_pedersen()
+        assert len(shares) == n
+        assert len(coefficients) == threshold - 1
+        assert len(blinding_coefficients) == threshold
+
+        commitments = sss.commit_coefficients_pedersen(coefficients, blinding_coefficients)
+        assert len(commitments) == threshold
+        assert commitments[0] == secret.num * G + blinding_coefficients[0].num * H
+        # The first commitment should not leak secret * G as in Feldman's scheme
+        assert commitments[0] != secret.num * G
+
+        # Users should be able to verify their share one by one or in a batch
+        for share in shares:
+            assert sss.verify_share_pedersen(share, commitments)
+        assert sss.verify_shares_pedersen(shares, commitments)
+
+        # A tampered share should be rejected both alone and within a batch
+        i, s_i, r_i = shares[1]
+        tampered = (i, s_i + FieldElement(1, N), r_i)
+        assert not sss.verify_share_pedersen(tampered, commitments)
+        assert not sss.verify_shares_pedersen(shares[:1] + [tampered] + shares[2:], commitments)
+
+        # The secret part of the shares should recover the secret
+        assert sss.recover_secret([(i, s_i) for i, s_i, _ in shares]) == secret
+
+        # Should throw an error on an empty batch
+        with self.assertRaises(ValueError):
+            sss.verify_shares_pedersen([], commitments)
+        with self.assertRaises(ValueError):
+            sss.verify_shares_pedersen(shares, [])
+        # Should throw an error on a fixed base table for the point at infinity
+        with self.assertRaises(ValueError):
+            FixedBaseTable.for_point(S256Point(None, None))
+
+    def test_lru_cache(self):
+        cache = LRUCache(2)
+        builds = []
+        def build(key):
+            builds.append(key)
+            return key * 10
+        assert cache.get_or_build(1, lambda: build(1)) == 10
+        assert cache.get_or_build(2, lambda: build(2)) == 20
+        # using 1 again makes 2 the least recently used entry
+        assert cache.get_or_build(1, lambda: build(1)) == 10
+        cache.get_or_build(3, lambda: build(3))
+        assert builds == [1, 2, 3]
+        assert len(cache) == 2
+        assert 1 in cache and 3 in cache and 2 not in cache
+
+    def test_randomness_provider(self):
+        # The seeded mode should be deterministic
+        first = RandomnessProvider(seed=b'benchmark', block_size=64)
+        second = RandomnessProvider(seed=b'benchmark', block_size=64)
+        assert first.randbelow_many(N, 100) == second.randbelow_many(N, 100)
+        assert RandomnessProvider(seed=1).random_bytes(32) != RandomnessProvider(seed=2).random_bytes(32)
+
+        # Values should stay within the requested range and cover it
+        for rng in [RandomnessProvider(), RandomnessProvider(seed=7)]:
+            values = rng.randbelow_many(5, 500)
+            assert set(values) == {0, 1, 2, 3, 4}
+            assert all(3 <= rng.randint(3, 9) <= 9 for _ in range(100))
+            assert rng.randbits(13) < 2**13
+            elements = rng.field_elements(50, 11, low=1)
+            assert all(1 <= element.num <= 10 and element.prime == 11 for element in elements)
+
+        with self.assertRaises(ValueError):
+            RandomnessProvider().randbelow(0)
+
+        # Sharing with the same seed should give the same shares
+        secret = FieldElement(random.randint(1, N - 1), N)
+        shares_1, _ = ShamirSecretSharing(3, 5, secret, rng=RandomnessProvider(seed=42)).split_secret()
+        shares_2, _ = ShamirSecretSharing(3, 5, secret, rng=RandomnessProvider(seed=42)).split_secret()
+        assert shares_1 == shares_2
+
+        # The default provider can be replaced and restored
+        RandomnessProvider.set_default(RandomnessProvider(seed=42))
+        try:
+            shares_3, _ = ShamirSecretSharing(3, 5, secret).split_secret()
+        finally:
+            RandomnessProvider.set_default(None)
+        assert shares_3 == shares_1
+        assert RandomnessProvider.default().seed is None
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'requires os.fork')
+    def test_randomness_provider_fork(self):
+        # A forked child must not reuse the bytes buffered by the parent
+        rng = RandomnessProvider(block_size=4096)
+        rng.random_bytes(16)
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_end)
+            os.write(write_end, rng.random_bytes(32))
+            os._exit(0)
+        os.close(write_end)
+        with os.fdopen(read_end, 'rb') as f:
+            child_bytes = f.read()
+        os.waitpid(pid, 0)
+        assert len(child_bytes) == 32
+        assert rng.random_bytes(32) != child_bytes
+
+    def test_streaming_secret_sharing(self):
+        threshold = 3
+        n = 5
+        # small batches to exercise the chunk boundaries
+        sss = StreamingSecretSharing(threshold, n, N, batch_size=4)
+        assert sss.chunk_size == 31
+        assert sss.share_size == 32
+
+        for length in [0, 1, 30, 31, 32, 31 * 4, 31 * 4 + 1, 1000]:
+            payload = bytes(random.getrandbits(8) for _ in range(length))
+            sinks = [io.BytesIO() for _ in range(n)]
+            sss.split_stream(io.BytesIO(payload), sinks)
+
+            # every party gets a header plus one share per padded chunk
+            chunks = length // sss.chunk_size + 1
+            for sink in sinks:
+                assert len(sink.getvalue()) == sss.share_size * (chunks + 1)
+
+            # any subset of threshold streams should recover the payload
+            subset = random.sample(sinks, threshold)
+            recovered = io.BytesIO()
+            sss.recover_stream([io.BytesIO(sink.getvalue()) for sink in subset], recovered)
+            assert recovered.getvalue() == payload
+
+        # Should throw an error if there are fewer streams than the threshold
+        with self.assertRaises(ValueError):
+            sss.recover_stream([io.BytesIO(sink.getvalue()) for sink in sinks[:threshold - 1]], io.BytesIO())
+
+        # Should throw an error if a stream is truncated
+        streams = [io.BytesIO(sink.getvalue()) for sink in sinks[:threshold]]
+        streams[0] = io.BytesIO(sinks[0].getvalue()[:-1])
+        with self.assertRaises(ValueError):
+            sss.recover_stream(streams, io.BytesIO())
+
     def test_distributed_key_generation(self):
 
         # Setup DKG
@@ -277,6 +557,35 @@ class ECCTest(unittest.TestCase):
     #     # Should compute the public key for the DKG ceremony
     #     assert dkg.compute_public_key() == sum([member.secret for member in dkg.members])
 
+    def test_constant_time_ladder(self):
+        point = 12345 * G
+        for scalar in [0, 1, 2, 3, N - 1, N, N + 1] + [random.randint(1, N - 1) for _ in range(5)]:
+            assert G.ladder(scalar) == scalar * G
+            assert point.mul(scalar, constant_time=True) == point.mul(scalar, constant_time=False)
+        assert S256Point(None, None).ladder(5) == S256Point(None, None)
+
+        # The complete formulas should double and handle the point at infinity without special cases
+        x, y = G.x.num, G.y.num
+        p = S256Field(0).prime
+        for (X, Y, Z), expected in [(S256Point._complete_add(x, y, 1, x, y, 1), 2 * G), (S256Point._complete_add(x, y, 1, 0, 1, 0), G)]:
+            z_inv = pow(Z, -1, p)
+            assert S256Point(X * z_inv % p, Y * z_inv % p) == expected
+        assert S256Point._complete_add(0, 1, 0, 0, 1, 0)[2] == 0
+
+        # KeyPair can use the ladder per call or through the global default
+        secret = int("f8f8a2f43c8376ccb0871305060d7b27b0554d2cc72bccf41b2705608452f315", 16)
+        other = KeyPair(int("aaaaa2f43c8376ccb0871305060d7b27b0554d2cc72bccf41b2705608452f315", 16))
+        fast = KeyPair(secret, constant_time=False)
+        safe = KeyPair(secret, constant_time=True)
+        assert fast.point == safe.point
+        assert fast.generate_shared_secret(other.point) == safe.generate_shared_secret(other.point)
+        S256Point.constant_time = True
+        try:
+            assert KeyPair(secret).point == fast.point
+            assert 7 * G == G + G + G + G + G + G + G
+        finally:
+            S256Point.constant_time = False
+
     def test_dhke(self):
 
         a = int("f8f8a2f43c8376ccb0871305060d7b27b0554d2cc72bccf41b2705608452f315", 16)
@@ -333,11 +642,67 @@ class ECCTest(unittest.TestCase):
     def test_puzzle(self):
 
         # generate a random message to encrypt
-        message_to_encrypt = random.randint(1, 1000)
+        message_to_encrypt = bytes(random.getrandbits(8) for _ in range(100))
 
-        (_, _, n, a, t, enc_key, enc_message, _) = TimeLockPuzzle.encrypt(message_to_encrypt, 10, 20) 
+        (p, q, n, a, t, enc_key, enc_message, _) = TimeLockPuzzle.encrypt(message_to_encrypt, 10, 20, bits=512)
 
+        assert n == p * q and n.bit_length() == 512
+        assert t == 200
+        assert enc_message != message_to_encrypt
         assert TimeLockPuzzle.decrypt(n, a, t, enc_key, enc_message) == message_to_encrypt
+        # empty messages are supported too
+        (_, _, n, a, t, enc_key, enc_message, _) = TimeLockPuzzle.encrypt(b'', 1, 5, bits=512)
+        assert TimeLockPuzzle.decrypt(n, a, t, enc_key, enc_message) == b''
+        # too small moduli are rejected before spending time on the calibration
+        calibrate = TimeLockSolver.calibrate
+        TimeLockSolver.calibrate = staticmethod(lambda bits: self.fail('calibrated before validating bits'))
+        try:
+            with self.assertRaises(ValueError):
+                TimeLockPuzzle.encrypt(b'secret', 1, bits=128)
+        finally:
+            TimeLockSolver.calibrate = calibrate
+
+        # Creating a puzzle should take O(log t) time, so a puzzle of 10^12 squarings should be created instantly
+        (_, _, n, a, t, enc_key, _, key) = TimeLockPuzzle.encrypt(b'secret', 10**6, 10**6, bits=512)
+        assert t == 10**12
+        assert enc_key != key
+
+    def test_puzzle_solver(self):
+        assert TimeLockSolver.calibrate(bits=512, duration=0.05) > 0
+
+        message = b'timed release'
+        (_, _, n, a, t, enc_key, enc_message, _) = TimeLockPuzzle.encrypt(message, 1, 1000, bits=512)
+        expected = pow(a, 2**t, n)
+
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint_path = os.path.join(directory, 'puzzle.json')
+
+            # Simulate a crash after 400 squarings
+            def crash(iteration, total):
+                if iteration == 400:
+                    raise KeyboardInterrupt
+            with self.assertRaises(KeyboardInterrupt):
+                TimeLockSolver(checkpoint_path, checkpoint_interval=100, progress=crash, progress_interval=200).solve(n, a, t)
+
+            # Resuming should start from the last checkpoint and report progress until the end
+            reported = []
+            solver = TimeLockSolver(checkpoint_path, checkpoint_interval=100, progress=lambda i, total: reported.append(i), progress_interval=200)
+            assert solver.load_checkpoint(n, a, t) == (400, pow(a, 2**400, n))
+            assert solver.solve(n, a, t) == expected
+            assert reported == [600, 800, 1000]
+            assert TimeLockPuzzle.decrypt(n, a, t, enc_key, enc_message, solver) == message
+
+            # Should throw an error if the checkpoint belongs to another puzzle
+            with self.assertRaises(ValueError):
+                solver.solve(n, a + 1, t)
+
+            # Many puzzles can be solved concurrently
+            puzzles = [(n, a, t, enc_key, enc_message)]
+            (_, _, n_2, a_2, t_2, enc_key_2, enc_message_2, _) = TimeLockPuzzle.encrypt(b'another one', 1, 500, bits=512)
+            puzzles.append((n_2, a_2, t_2, enc_key_2, enc_message_2))
+            assert TimeLockSolver.solve_many(puzzles) == [message, b'another one']
+            assert TimeLockSolver.solve_many(puzzles, processes=2, checkpoint_dir=directory) == [message, b'another one']
+            assert os.path.exists(os.path.join(directory, 'puzzle-1.json'))
 
     def test_xor_encryption(self):
 
@@ -357,17 +722,14 @@ class ECCTest(unittest.TestCase):
         assert dec_message == message_to_encrypt
 
 
-from sympy import randprime
-
 class TestRSA(unittest.TestCase):
 
     def setUp(self):
-        p = randprime(0, 200)
-        q = randprime(0, 200)
+        p = RSA.generate_prime(8)
+        q = RSA.generate_prime(8)
         # if p == q, need to regenerate
         while p == q:
-            p = randprime(0, 200)
-            q = randprime(0, 200)
+            q = RSA.generate_prime(8)
         self.rsa = RSA(p, q)
 
     def test_keys(self):
@@ -387,11 +749,76 @@ class TestRSA(unittest.TestCase):
         self.assertTrue(self.rsa.is_prime(17))
         self.assertFalse(self.rsa.is_prime(20))
 
+    def test_miller_rabin(self):
+        # Small numbers, Carmichael numbers and strong pseudoprimes to base 2
+        primes = [2, 3, 5, 1999, 2003, 4000037, 2**31 - 1, 2**61 - 1, 2**89 - 1, 2**127 - 1, 2**521 - 1]
+        composites = [0, 1, 4, 561, 1105, 2047, 3215031751, 4000037 * 4000039, 3825123056546413051, 2**67 - 1, (2**61 - 1) * (2**89 - 1)]
+        for p in primes:
+            self.assertTrue(RSA.is_prime(p))
+        for n in composites:
+            self.assertFalse(RSA.is_prime(n))
+
+    def test_generate(self):
+        for bits in [64, 65, 512]:
+            p = RSA.generate_prime(bits)
+            self.assertEqual(p.bit_length(), bits)
+            self.assertTrue(RSA.is_prime(p))
+
+        rsa = RSA.generate(512)
+        self.assertEqual(rsa.n.bit_length(), 512)
+        self.assertNotEqual(rsa.p, rsa.q)
+        message = random.randint(2, rsa.n - 1)
+        self.assertEqual(rsa.decrypt(rsa.encrypt(message)), message)
+
+    def test_crt_and_batch(self):
+        rsa = RSA.generate(512)
+        self.assertEqual(rsa.public_key, RSA.DEFAULT_PUBLIC_EXPONENT)
+        messages = [random.randint(0, rsa.n - 1) for _ in range(20)]
+        # CRT decryption should match decryption with the full modulus
+        for message in messages:
+            self.assertEqual(rsa.decrypt(message), pow(message, rsa.private_key, rsa.n))
+
+        ciphertexts = rsa.encrypt_many(messages)
+        self.assertEqual(ciphertexts, [rsa.encrypt(message) for message in messages])
+        self.assertEqual(rsa.decrypt_many(ciphertexts), messages)
+        self.assertEqual(rsa.decrypt_many(rsa.encrypt_many(messages, processes=2), processes=2), messages)
+
+        # A random public exponent can still be requested
+        other = RSA(rsa.p, rsa.q, check_primes=False)
+        self.assertEqual(other.decrypt(other.encrypt(messages[0])), messages[0])
+        # Should throw an error if the public exponent is not coprime with phi(n)
+        with self.assertRaises(ValueError):
+            RSA(rsa.p, rsa.q, check_primes=False, public_exponent=2)
+
     def test_gcd(self):
         # Ensure that gcd function is working
         self.assertEqual(self.rsa.gcd(48, 18), 6)
         self.assertEqual(self.rsa.gcd(101, 103), 1)
 
 
+import json
+
+import bench_ecc
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_compare(self):
+        baseline = {'fast': {'median': 1.0}, 'slow': {'median': 1.0}}
+        results = {'fast': {'median': 1.1}, 'slow': {'median': 1.5}, 'new': {'median': 9.0}}
+        regressions = bench_ecc.compare(results, baseline, threshold=0.2)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith('slow'))
+
+    def test_run(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            self.assertEqual(bench_ecc.main(['--filter', 'recover_secret[t=3,N=5]', '--rounds', '1', '--output', output]), 0)
+            with open(output) as f:
+                results = json.load(f)['results']
+            self.assertEqual(list(results), ['recover_secret[t=3,N=5]'])
+            # a run compared against itself with a generous threshold should not regress
+            self.assertEqual(bench_ecc.main(['--filter', 'recover_secret[t=3,N=5]', '--rounds', '1', '--output', output, '--baseline', output, '--threshold', '100']), 0)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file